@@ -1,13 +1,32 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from hermes_python.hermes import Hermes
-import requests
-import json
-import random
-import subprocess
+import logging
+import os
+import threading
 import time
 
+import backend
+from backend import (BackendClient, BackendUnavailable, DeadlineExceeded,
+                     RequestRejected)
+from catalog import ProcedureCatalog
+from dedup import DUPLICATE_INTENTS, RecordingHermes, ReplyCache, replay
+from dialogue import DialogueMachine, MessageTable, StepMessages
+from display import DisplayMonitor
+from gui import GuiDispatcher
+from journal import SessionJournal
+import logs
+import metrics
+from model import ProcedureDetail, Step
+from prefetch import ProcedurePrefetcher
+from push import PushChannel
+from replies import ChunkedHermes
+from runner import AsyncRunner
+from selection import SelectionResolver
+from snapshot import ProcedureSnapshot
+from sessions import SessionStore
+from steps import StepWindow
+
 MQTT_IP_ADDR = "localhost"
 MQTT_PORT = 1883
 MQTT_ADDR = "{}:{}".format(MQTT_IP_ADDR, str(MQTT_PORT))
@@ -25,449 +44,723 @@ INTENT_HELP = "livingonmars:help"
 INTENT_CONFIRM_CANCEL = "livingonmars:confirmExit"
 INTENT_HELLO = "livingonmars:hello"
 
+# "callback" handles the intents on the Hermes callback thread, "asyncio"
+# hands them to an event loop, which handles the intents of different sites
+# at the same time on up to HANDLER_WORKERS threads
+HANDLER_MODE = "callback"
+HANDLER_WORKERS = 8
+
 # addresses for connections to the DB and GUI API servers
 DB_ADDR = "http://localhost:8000"
 GUI_ADDR = "http://localhost:4040"
 
-# save the procedures list
-procedures_list = ""
+# kept-alive connections per API server, and seconds to wait for connecting
+# to it and for its answer
+# the DB timeouts are shorter than the intent budgets, so that a DB which
+# does not answer counts as failing for its circuit breaker, instead of only
+# running out the time of every intent
+DB_POOL_SIZE = 4
+DB_CONNECT_TIMEOUT = 1.0
+DB_READ_TIMEOUT = 2.0
+GUI_POOL_SIZE = 2
+GUI_CONNECT_TIMEOUT = 0.5
+GUI_READ_TIMEOUT = 2.0
+
+# seconds after which a GET to the DB API without an answer is sent once
+# more, None to never send it twice
+DB_HEDGE_AFTER = 0.5
+
+# seconds an intent may take from its arrival to the reply, including the
+# time it waited for the intents of the same site, by intent name, intents
+# not listed get INTENT_BUDGET
+# the requests to the DB API are cut short to fit, and once the time is up
+# the reply is made from the stored copy of the DB answers, or says the DB
+# cannot be reached, while the GUI is updated in the background anyway
+INTENT_BUDGET = 2.5
+INTENT_BUDGETS = {
+    "confirmProcedure": 4.0,
+    "startProcedure": 4.0,
+}
+
+# failed requests in a row after which an API server is considered down, and
+# seconds until it is tried again
+BACKEND_FAILURE_THRESHOLD = 3
+BACKEND_RESET_TIMEOUT = 10.0
+
+# how many GUI updates may wait to be sent
+GUI_QUEUE_SIZE = 32
+
+# local port of the server-sent events channel pushing the updates to the GUI
+# (GET /events), None to only send them to the GUI API
+GUI_PUSH_PORT = None
+
+# command telling whether a display is attached, and seconds between two runs
+DISPLAY_PROBE_COMMAND = ["sudo", "tvservice", "-s"]
+DISPLAY_PROBE_INTERVAL = 5.0
+
+# seconds after which the session of a silent site is dropped, and how many
+# sites may have a session at the same time
+SESSION_IDLE_TIMEOUT = 3600
+MAX_SESSIONS = 64
+
+# seconds the procedures list is served from memory before it is revalidated,
+# and how long a stale list may still be served while revalidating
+CATALOG_TTL = 60
+CATALOG_MAX_STALE = 600
+
+# how many procedures are read out and shown at once
+PROCEDURES_PAGE_SIZE = 10
+
+# steps kept in memory on each side of the current step
+STEP_WINDOW_RADIUS = 3
+
+# local copy of the DB API answers, and seconds between two refreshes of it
+SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "procedures-snapshot.sqlite")
+SNAPSHOT_REFRESH_INTERVAL = 900
+
+# journal of the session states, seconds between two syncs of it to the disk,
+# and changes after which it is compacted
+JOURNAL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "sessions.journal")
+JOURNAL_FSYNC_INTERVAL = 0.5
+JOURNAL_COMPACT_AFTER = 1000
+
+# local port of the Prometheus metrics endpoint, None to not serve it
+METRICS_PORT = 9464
+
+# lowest level written to the log, records that may wait for the writer
+# thread, and how many state-trace lines with the same text a site may log
+# per interval of seconds
+LOG_LEVEL = "INFO"
+LOG_QUEUE_SIZE = 1000
+LOG_RATE_BURST = 5
+LOG_RATE_INTERVAL = 1.0
+
+# replies kept to answer an intent delivered twice for the same dialogue
+# session without handling it again, and the slots of the intents, which
+# tell a new answer from the same intent delivered again
+REPLY_CACHE_SIZE = 256
+INTENT_SLOTS = ("procedure", "confirmation")
+
+# characters of a reply said in one go, by (stage, state) of the session
+# after the intent, longer replies are cut after a sentence and the rest is
+# said in notifications that follow, so that the TTS starts sooner
+# states not listed use REPLY_BUDGET, None to never cut
+REPLY_BUDGET = 240
+REPLY_BUDGETS = {
+    (0, 0): 160,                # STATE 0.0: Initial, e.g. the greeting
+    (1, 1): 200,                # STATE 1.1: Listing Available Procedure
+    (2, 1): 200,                # STATE 2.1: Listing the Ingredients
+}
+
+# message for when the DB API cannot be reached
+DB_UNAVAILABLE_MESSAGE = "Sorry, I cannot reach the experiments right now. Please call me again in a moment."
+
+# message for when the DB API does not have the selected procedure anymore
+PROCEDURE_GONE_MESSAGE = "Sorry, this experiment is not available anymore. Please call me again, and select another experiment."
+
+log = logging.getLogger("skill")
+# state-trace lines, rate limited
+trace = logging.getLogger("skill.state")
+
+# clients for the DB and GUI API servers
+db = BackendClient(DB_ADDR, DB_POOL_SIZE, DB_CONNECT_TIMEOUT, DB_READ_TIMEOUT,
+                   BACKEND_FAILURE_THRESHOLD, BACKEND_RESET_TIMEOUT, "db",
+                   DB_HEDGE_AFTER)
+gui_client = BackendClient(GUI_ADDR, GUI_POOL_SIZE, GUI_CONNECT_TIMEOUT,
+                           GUI_READ_TIMEOUT, BACKEND_FAILURE_THRESHOLD,
+                           BACKEND_RESET_TIMEOUT, "gui")
+
+# copy of the DB API answers served when the DB is down or the skill restarts
+snapshot = ProcedureSnapshot(SNAPSHOT_FILE)
+
+# shared cache for the procedures list of the DB API, with the index of the
+# numbers and titles the user may say to select one
+catalog = ProcedureCatalog(db, "/procedures", CATALOG_TTL, CATALOG_MAX_STALE,
+                           snapshot, SelectionResolver)
+
+# returns the detail of a procedure as a model.ProcedureDetail, from the
+# snapshot when the DB is down
+def load_procedure(procedure_id):
+    return ProcedureDetail.from_json(
+        snapshot.fetch(db, "/procedures/" + str(procedure_id)))
+
+# returns the stored detail of a procedure, or None
+def stored_procedure(procedure_id):
+    document = snapshot.get("/procedures/" + str(procedure_id))
+    if document is None:
+        return None
+    return ProcedureDetail.from_json(document)
+
+# brings the steps of a procedure in the snapshot up to date with the DB,
+# they are then read from the snapshot a few at a time
+def sync_procedure_steps(procedure_id):
+    snapshot.fetch(db, "/proceduresteps/" + str(procedure_id), load=False)
+
+# returns a window over the steps of the selected procedure, around the
+# current step
+def open_step_window(session, current_step=None):
+    steps_path = "/proceduresteps/" + str(session.selected_procedure)
+    total_steps = session.total_steps
+
+    def load(first, last):
+        return [(number, Step.from_body(number, body)) for number, body
+                in snapshot.get_steps(steps_path, first, last, raw=True)]
+
+    def render(number, step):
+        return STEP_MESSAGES.render(number, total_steps, step.description)
+
+    window = StepWindow(load, render, STEP_WINDOW_RADIUS)
+    window.move(current_step if current_step is not None
+                else session.current_step)
+    return window
+
+# background loader for the detail and the steps of the selected procedure,
+# which are requested at the same time
+procedure_prefetcher = ProcedurePrefetcher({
+    "detail": load_procedure,
+    "steps": sync_procedure_steps,
+})
+
+# background sender for the updates of the GUI API, pushed to the GUIs
+# connected to the events channel instead
+gui_push = PushChannel(GUI_QUEUE_SIZE)
+gui = GuiDispatcher(gui_client, GUI_QUEUE_SIZE, push=gui_push)
+
+# last known state of the display, refreshed in the background
+display = DisplayMonitor(DISPLAY_PROBE_COMMAND, DISPLAY_PROBE_INTERVAL)
+
+# every change of a session is journaled, so that it survives a crash
+journal = SessionJournal(JOURNAL_FILE, JOURNAL_FSYNC_INTERVAL,
+                         JOURNAL_COMPACT_AFTER)
+
+# called when the session of a site is dropped
+def forget_session(session):
+    procedure_prefetcher.cancel(session.site_id)
+    journal.forget(session.site_id)
+
+# dialogue state of every site, see sessions.Session
+sessions = SessionStore(SESSION_IDLE_TIMEOUT, MAX_SESSIONS, forget_session)
+
+# snapshot paths of the procedures the sessions selected, kept while they
+# are used even when the DB dropped them
+def procedures_in_use():
+    paths = []
+    for session in sessions.sessions():
+        if session.selected_procedure > 0:
+            paths.append("/procedures/" + str(session.selected_procedure))
+            paths.append("/proceduresteps/" + str(session.selected_procedure))
+    return paths
+
+INTENT_SECONDS = metrics.registry.histogram(
+    "skill_intent_seconds", "Duration of the intent handlers",
+    ("intent", "state"))
+INTENT_PHASE_SECONDS = metrics.registry.histogram(
+    "skill_intent_phase_seconds",
+    "Time spent by the intent handlers on the DB, the GUI and Hermes",
+    ("intent", "phase"))
+WRONG_INTENTS = metrics.registry.counter(
+    "skill_wrong_intents_total",
+    "Intents detected in a state where they make no sense", ("state",))
+UNRECOGNIZED_INTENTS = metrics.registry.counter(
+    "skill_unrecognized_intents_total", "Utterances matching no intent",
+    ("state",))
+LATE_REPLIES = metrics.registry.counter(
+    "skill_late_replies_total",
+    "Intents replied to after their budget of INTENT_BUDGETS", ("intent",))
+
+# replies of the last intents, by (session id, intent, slot values)
+handled_replies = ReplyCache(REPLY_CACHE_SIZE)
+
+# values of the INTENT_SLOTS of the intent message, None for a missing slot
+def slot_values(intent_message):
+    values = []
+    for name in INTENT_SLOTS:
+        slot = getattr(intent_message.slots, name).first()
+        values.append(str(slot.value) if slot is not None else None)
+    return tuple(values)
+
+# runs the handler with the session of the site the intent came from
+# an intent delivered again for the same session with the same slots gets
+# the same reply, without changing the session or the GUI a second time
+def with_session(intent, handler):
+    name = intent.split(":")[-1]
+
+    # arrived is the perf_counter() time the intent came in, when it waited
+    # before being handled, e.g. in the queue of the AsyncRunner
+    def handle(hermes, intent_message, arrived=None):
+        started = time.perf_counter()
+        if arrived is None:
+            arrived = started
+        metrics.start_phases()
+        session = sessions.get(intent_message.site_id)
+        logs.set_context(session.site_id, intent_message.session_id)
+        with session.lock:
+            key = (intent_message.session_id, intent,
+                   slot_values(intent_message))
+            reply = handled_replies.get(key)
+            if reply is not None:
+                DUPLICATE_INTENTS.inc((name,))
+                log.info("%s delivered again, repeating the reply", name)
+                metrics.stop_phases()
+                logs.clear_context()
+                return replay(hermes, intent_message.session_id, reply)
+
+            state = "{}.{}".format(session.stage, session.state)
+            recorder = RecordingHermes(metrics.TimedHermes(hermes))
+            replies = ChunkedHermes(
+                recorder, name, session.site_id,
+                lambda: REPLY_BUDGETS.get((session.stage, session.state),
+                                          REPLY_BUDGET), arrived)
+            backend.set_deadline(
+                INTENT_BUDGETS.get(name, INTENT_BUDGET) - (
+                    time.perf_counter() - arrived))
+            try:
+                return handler(replies, intent_message, session)
+            finally:
+                if backend.remaining() < 0:
+                    LATE_REPLIES.inc((name,))
+                backend.clear_deadline()
+                if recorder.reply is not None:
+                    handled_replies.put(key, recorder.reply)
+                journal.record(session.site_id, session.checkpoint())
+                INTENT_SECONDS.observe((name, state),
+                                       time.perf_counter() - started)
+                for phase, seconds in metrics.stop_phases().items():
+                    INTENT_PHASE_SECONDS.observe((name, phase), seconds)
+                logs.clear_context()
+    return handle
+
+READY_SECONDS = metrics.registry.gauge(
+    "skill_ready_seconds",
+    "Seconds from the start of the skill until it subscribed to the intents")
+
+# loads the procedures list, revalidating the stored copy, so that the first
+# intent does not wait for it
+def preload_catalog():
+    catalog.load_snapshot()
+    try:
+        catalog.refresh()
+        catalog.get_index()
+    except Exception as e:
+        log.warning("Cannot preload the procedures list: %s", e)
+
+# opens the pooled connections to the API servers, loads the procedures list
+# and starts the background threads, before subscribing to the intents
+def warm_up():
+    gui.start()
+    loaders = [threading.Thread(target=display.start),
+               threading.Thread(target=db.warm_up, args=(DB_POOL_SIZE,)),
+               threading.Thread(target=gui_client.warm_up,
+                                args=(GUI_POOL_SIZE,)),
+               threading.Thread(target=preload_catalog)]
+    for loader in loaders:
+        loader.start()
+    for loader in loaders:
+        loader.join()
+
+# puts the sessions back where they were when the skill stopped, with the
+# steps loaded from the snapshot instead of the DB
+def restore_sessions():
+    started = time.monotonic()
+    checkpoints = journal.replay()
+    for site_id, checkpoint in checkpoints.items():
+        session = sessions.get(site_id)
+        with session.lock:
+            session.restore(checkpoint)
+            if session.stage != 3:
+                continue
+
+            steps_path = "/proceduresteps/" + str(session.selected_procedure)
+            try:
+                if not snapshot.has(steps_path):
+                    sync_procedure_steps(session.selected_procedure)
+                session.steps = open_step_window(session)
+            except Exception as e:
+                log.warning("Cannot restore the steps of site %s: %s", site_id, e)
+                # Go back to STATE 0.0: Initial
+                session.stage = 0
+                session.state = 0
+                session.reset()
+            journal.record(site_id, session.checkpoint())
+
+    log.info("Restored %d sessions in %.1f ms", len(checkpoints),
+             (time.monotonic() - started) * 1000)
+
+# the (stage, state) pairs of the dialogue
+INITIAL = (0, 0)                # STATE 0.0: Initial
+LISTING = (1, 1)                # STATE 1.1: Listing Available Procedure
+SELECTING = (1, 2)              # STATE 1.2: Selecting a Procedure
+INGREDIENTS = (2, 1)            # STATE 2.1: Confirming the Selection & Listing the Ingredients
+FIRST_STEP = (3, 1)             # STATE 3.1: The First Step
+FOLLOWING = (3, 2)              # STATE 3.2: Following the Steps
+LAST_STEP = (3, 3)              # STATE 3.3: The Last Step
+ALL_STATES = [INITIAL, LISTING, SELECTING, INGREDIENTS, FIRST_STEP, FOLLOWING,
+              LAST_STEP]
+
+# triggered when "livingonmars:hello" is detected in STATE 0.0
+def hello(hermes, intent_message, session):
+    trace.info("STATE 0.0: Initial")
+    output_message = "Hello! I can help you with scientific experiments. Here is what I can do at any time. You can ask me to repeat. You can ask me to stop. Or you can ask me for help when you don't know what to do. If you want to do an experiment with me, call me after I finishe talking, and say, I want to do an experiment. Enjoy!"
 
-# save the selected procedure, start at 1
-selected_procedure = 0
-selected_procedure_title = ""
-resources_list = ""
+    return hermes.publish_end_session(intent_message.session_id, output_message)
 
-# save the steps data
-current_step = -1
-procedure_steps = None
-total_steps = -1
+# triggered in STATE 0.0 when the user wants to do an experiment
+def show_procedures(hermes, intent_message, session):
+    # Go to STATE 1.1: Listing Available Procedure
+    session.stage = 1
+    session.state = 1
+    session.procedures_page = 0
+    trace.info("STATE 1.1: Listing Available Procedure")
+
+    # get the list of procedures and the dialogue output for VUI
+    try:
+        output_message = proceduresListOutput(session)
+    except BackendUnavailable as e:
+        log.warning("%s", e)
+        # Stay in STATE 0.0: Initial
+        session.stage = 0
+        session.state = 0
+        output_message = DB_UNAVAILABLE_MESSAGE
 
-# save the current state
-STATE = 0
-STAGE = 0
+    return hermes.publish_end_session(intent_message.session_id, output_message)
 
-# triggered when "livingonmars:hello" is detected
-def hello(hermes, intent_message):
-    global STAGE, STATE
-    print("STATE 0.0: Initial")
+# triggered when "livingonmars:nextStep" is detected in STATE 1.1
+def next_page(hermes, intent_message, session):
+    trace.info("STATE 1.1: Next page of the procedures")
+    return list_page(hermes, intent_message, session,
+                     session.procedures_page + 1)
+
+# triggered when "livingonmars:previousStep" is detected in STATE 1.1
+def previous_page(hermes, intent_message, session):
+    trace.info("STATE 1.1: Previous page of the procedures")
+    return list_page(hermes, intent_message, session,
+                     session.procedures_page - 1)
+
+# auxiliary function that reads out another page of the procedures list
+def list_page(hermes, intent_message, session, page):
+    try:
+        procedures = catalog.get()
+    except BackendUnavailable as e:
+        log.warning("%s", e)
+        return hermes.publish_end_session(intent_message.session_id,
+                                          DB_UNAVAILABLE_MESSAGE)
 
-    if STAGE == 0 and STATE == 0:
-        output_message = "Hello! I can help you with scientific experiments. Here is what I can do at any time. You can ask me to repeat. You can ask me to stop. Or you can ask me for help when you don't know what to do. If you want to do an experiment with me, call me after I finishe talking, and say, I want to do an experiment. Enjoy!"
+    if page < 0:
+        output_message = "These are the first experiments. Please call me, and tell me the number of the experiment you want, or say next, to hear more."
+    elif page * PROCEDURES_PAGE_SIZE >= len(procedures):
+        output_message = "There are no more experiments. Please call me, and tell me the number of the experiment you want, or say previous, to hear the previous ones."
     else:
-        # get the default message for the current stage
-        output_message = get_wrong_intent_message()
+        session.procedures_page = page
+        output_message = procedures_page_output(session, procedures)
 
     return hermes.publish_end_session(intent_message.session_id, output_message)
 
-# triggered when "livingonmars:showProcedures" is detected
-def show_procedures(hermes, intent_message):
-    global STAGE, STATE
-
-    if STAGE == 0 and STATE == 0:
-        # Go to STATE 1.1: Listing Available Procedure
-        STAGE = 1
-        STATE = 1
-        print("STATE 1.1: Listing Available Procedure")
+# triggered when "livingonmars:chooseProcedure" is detected in STATE 1.1
+def choose_procedure(hermes, intent_message, session):
+    # Go to STATE 1.2: Selecting a Procedure
+    session.stage = 1
+    session.state = 2
+    trace.info("STATE 1.2: Selecting a Procedure")
+
+    # get procedures data and their index from the catalog cache
+    try:
+        resolver = catalog.get_index()
+    except BackendUnavailable as e:
+        log.warning("%s", e)
+        # Stay in STATE 1.1: Listing Available Procedure
+        session.state = 1
+        return hermes.publish_end_session(intent_message.session_id,
+                                          DB_UNAVAILABLE_MESSAGE)
+    procedures = resolver.procedures
+
+    # get what the user said and find the number, ordinal or title it means
+    slot = intent_message.slots.procedure.first()
+    matches = resolver.resolve(slot.value if slot is not None else None)
+    if not matches:
+        session.state = 1
+        return hermes.publish_end_session(intent_message.session_id, "Sorry, I didn't get that. Please call me again, and tell me the number or the name of the experiment")
+        # TODO Test this. Changed from end_session to continue_session, so that the user can reselect once the wrong input is detected.
+
+    if len(matches) > 1:
+        session.state = 1
+        return hermes.publish_end_session(intent_message.session_id, "There are {} experiments with that name, like number {}, {}, and number {}, {}. Please call me again, and tell me the number of the experiment".format(
+            len(matches), matches[0], procedures[matches[0] - 1].title,
+            matches[1], procedures[matches[1] - 1].title))
+
+    session.selected_procedure = matches[0]
+
+    if session.selected_procedure > len(procedures):
+        # the cached list may be older than the DB, so check it once more
+        catalog.invalidate()
+        try:
+            procedures = catalog.get()
+        except BackendUnavailable as e:
+            log.warning("%s", e)
+            procedures = []
+
+    if not 0 < session.selected_procedure <= len(procedures):
+        session.state = 1
+        return hermes.publish_end_session(intent_message.session_id, "Sorry, there is no experiment number {}. Please call me again, and select another number".format(session.selected_procedure))
+
+    session.selected_procedure_title = procedures[session.selected_procedure - 1].title
 
-        # get the list of procedures and the dialogue output for VUI
-        output_message = proceduresListOutput()
+    # create dialogue output for VUI
+    output_message = "You selected {}, {}. Is this correct?".format(
+        str(session.selected_procedure), session.selected_procedure_title)
 
-        return hermes.publish_end_session(intent_message.session_id, output_message)
-    elif STAGE == 1 and STATE == 3:
-        # Go to STATE 2.1: Showing Procedure Overview
-        STAGE = 2
-        STATE = 1
-        print("STATE 2.1: Showing Procedure Overview")
+    # start loading the detail and the steps while the user confirms the selection
+    procedure_prefetcher.prefetch(session.site_id, session.selected_procedure)
 
-        # get the procedure steps and the dialogue output for VUI
-        output_message = get_procedure_steps()
+    if isConnected():
+        # request to GUI API to highlight the selected procedure
+        gui.post("/select", {'id': session.selected_procedure})
 
-        if isConnected():
-            # Sending the instructions to the GUI
-            r = requests.post(GUI_ADDR + "/start")
+    return hermes.publish_continue_session(intent_message.session_id, output_message, [INTENT_CONFIRM])
 
-        return hermes.publish_end_session(intent_message.session_id, output_message)
-    else:
-        # get the default message for the current stage
-        output_message = get_wrong_intent_message()
-        return hermes.publish_end_session(intent_message.session_id, output_message)
+# triggered when "livingonmars:confirmProcedure" is detected in STATE 1.2
+def confirm_procedure(hermes, intent_message, session):
+    # a wrong answer that wasn't detected as YES or NO, so do the confirm again
+    if intent_message.slots.confirmation.first() == None:
+        output_message = get_wrong_intent_message(session)
+        return hermes.publish_continue_session(intent_message.session_id, output_message, [INTENT_CONFIRM])
 
-# triggered when "livingonmars:chooseProcedure" is detected
-def choose_procedure(hermes, intent_message):
-    global STAGE, STATE, selected_procedure, procedures
+    # get what the user said
+    raw_choice = intent_message.slots.confirmation.first().value
+
+    # check if it's yes and we know the number of the selected procedure
+    if raw_choice == "yes" and session.selected_procedure != -1:
+        log.info("Procedure %d confirmed", session.selected_procedure)
+
+        # make sure the detail and the steps are loading, at the same time
+        procedure_prefetcher.prefetch(session.site_id, session.selected_procedure)
+
+        # get the procedure detail from the DB API, the steps go on loading
+        # while the resources are read out
+        try:
+            procedure = procedure_prefetcher.get(
+                session.site_id, session.selected_procedure, "detail")
+        except DeadlineExceeded as e:
+            # the DB is too slow for this intent, read out the stored detail
+            log.warning("%s, answering from the snapshot", e)
+            procedure = stored_procedure(session.selected_procedure)
+        except RequestRejected as e:
+            log.warning("%s", e)
+            return procedure_gone(hermes, intent_message, session)
+        except BackendUnavailable as e:
+            log.warning("%s", e)
+            procedure = None
+        if procedure is None:
+            # Stay in STATE 1.2: Selecting a Procedure
+            return hermes.publish_continue_session(
+                intent_message.session_id,
+                DB_UNAVAILABLE_MESSAGE + " Is this the experiment you want?",
+                [INTENT_CONFIRM])
 
-    if STAGE == 0 and STATE == 0:
-        # Go to STATE 1.1: Listing Available Procedure
-        STAGE = 1
-        STATE = 1
-        print("STATE 1.1: Listing Available Procedure")
-        output_message = proceduresListOutput()
-        return hermes.publish_end_session(intent_message.session_id,
-                                          output_message)
-    elif STAGE == 1 and STATE == 1:
-        # Go to STATE 1.2: Selecting a Procedure
-        STAGE = 1
-        STATE = 2
-        print("STATE 1.2: Selecting a Procedure")
-
-        # get procedures data from the DB API
-        procedures = requests.get(DB_ADDR + "/procedures").json()
-
-        # get what the user said and select the corresponding value
-        raw_choice = intent_message.slots.procedure.first().value
-        if raw_choice == "one":
-            selected_procedure = 1
-        elif raw_choice == "two":
-            selected_procedure = 2
-        elif raw_choice == "three":
-            selected_procedure = 3
-        elif raw_choice == "four":
-            selected_procedure = 4
-        elif raw_choice == "five":
-            selected_procedure = 5
-        elif raw_choice == "six":
-            selected_procedure = 6
-        else:
-            STATE = 1
-            return hermes.publish_end_session(intent_message.session_id, "Sorry, I didn't get that. Please call me again, and select a number from one to six")
-            # TODO Test this. Changed from end_session to continue_session, so that the user can reselect once the wrong input is detected.
+        # Go to STATE 2.1: Confirming the Selection & Listing the Ingredients
+        session.stage = 2
+        session.state = 1
+        trace.info("STATE 2.1: Confirming the Selection & Listing the Ingredients")
+        session.selected_procedure_title = procedure.title
+        session.total_steps = procedure.steps_count
+        session.resources_list = "".join(
+            title + ", " for title in procedure.resources)
 
         # create dialogue output for VUI
-        output_message = "You selected {}, {}. Is this correct?".format(
-            str(selected_procedure), # TODO bug here when DB is down??
-            str(procedures[selected_procedure - 1]["title"]))
+        output_message = "All right! Here is experiment {}. It has {} steps. Let me know, when you're ready to start. For this experiment, you will need. {}".format(
+            session.selected_procedure_title, session.total_steps, session.resources_list)
 
         if isConnected():
-            # request to GUI API to highlight the selected procedure
-            r = requests.post(GUI_ADDR + "/select",
-                              json={'id': selected_procedure})
-
-        return hermes.publish_continue_session(intent_message.session_id, output_message, [INTENT_CONFIRM])
-    elif STAGE == 1 and STATE == 3:
-        # Go to STATE 2.1: Starting the Selected Experiment - Listing Ingredients
-        STAGE = 2
-        STATE = 1
-        print(
-            "STATE 2.1: Starting the Selected Experiment - Listing Ingredients"
-        )
+            # request to GUI API to show the procedure detail
+            gui.post("/confirm", procedure.document)
 
-    else:
-        # get the default message for the current stage
-        output_message = get_wrong_intent_message()
         return hermes.publish_end_session(intent_message.session_id, output_message)
 
-# triggered when "livingonmars:confirmProcedure" is detected
-def confirm_procedure(hermes, intent_message):
-    global STAGE, STATE, selected_procedure, total_steps, resources_list, selected_procedure_title
+    else:
+        # user said no so the system goes back to the list
+        # Go to STATE 1.1: Listing Available Procedure
+        session.stage = 1
+        session.state = 1
+        trace.info("STATE 1.1: Listing Available Procedure")
+        output_message = get_repeat_message_output(session)
 
-    # output message for wrong intent recognised or for a wrong answer that wasn't detected as YES or NO
-    output_message = get_wrong_intent_message()
+        # the steps of the rejected procedure are not needed anymore
+        procedure_prefetcher.cancel(session.site_id)
 
-    # if we are at the right stage and any slot was detected (yes or no answer was matched)
-    if STAGE == 1 and STATE == 2 and intent_message.slots.confirmation.first() != None:
-        # Go to STATE 2.1: Confirming the Selection & Listing the Ingredients
-        STAGE = 2
-        STATE = 1
-        print("STATE 2.1: Confirming the Selection & Listing the Ingredients")
+        if isConnected():
+            # go back to procedure list
+            gui.get("/confirm")
 
-        # get what the user said
-        raw_choice = intent_message.slots.confirmation.first().value
+        return hermes.publish_end_session(intent_message.session_id, output_message)
 
-        # check if it's yes and we know the number of the selected procedure
-        if raw_choice == "yes" and selected_procedure != -1:
-            print("Procedure " + str(selected_procedure) + " confirmed")
+# goes back to the list when the selected procedure is not in the DB anymore
+def procedure_gone(hermes, intent_message, session):
+    # Go to STATE 1.1: Listing Available Procedure
+    session.stage = 1
+    session.state = 1
+    trace.info("STATE 1.1: Listing Available Procedure")
+    procedure_prefetcher.cancel(session.site_id)
+    catalog.invalidate()
+    return hermes.publish_end_session(intent_message.session_id,
+                                      PROCEDURE_GONE_MESSAGE)
+
+# triggered when "livingonmars:startProcedure" is detected in STATE 2.1
+def start_procedure(hermes, intent_message, session):
+    try:
+        output_message = get_procedure_steps(session)
+    except RequestRejected as e:
+        log.warning("%s", e)
+        return procedure_gone(hermes, intent_message, session)
+    except BackendUnavailable as e:
+        log.warning("%s", e)
+        # Stay in STATE 2.1: Listing the Ingredients
+        return hermes.publish_end_session(intent_message.session_id,
+                                          DB_UNAVAILABLE_MESSAGE)
 
-            # request to the DB API to get the procedure detail
-            procedure = requests.get(DB_ADDR + "/procedures/" +
-                                     str(selected_procedure)).json()
-            resources_list = ""
-            selected_procedure_title = procedure["procedure"]["title"]
-            total_steps = procedure["stepsCount"]
-            for resource in procedure["resources"]:
-                resources_list += resource["title"] + ", "
+    # Go to STATE 3.1: The First Step
+    session.stage = 3
+    session.state = 1
+    trace.info("STATE 3.1: The First Step")
 
-            # create dialogue output for VUI
-            output_message = "All right! Here is experiment {}. It has {} steps. Let me know, when you're ready to start. For this experiment, you will need. {}".format(
-                selected_procedure_title, total_steps, resources_list)
+    if isConnected():
+        # Sending the instructions to the GUI
+        gui.post("/showstep", session.step.document)
 
-            if isConnected():
-                # request to GUI API to show the procedure detail
-                r = requests.post(GUI_ADDR + "/confirm", json=procedure)
+    return hermes.publish_end_session(intent_message.session_id,
+                                      output_message)
 
-            return hermes.publish_end_session(intent_message.session_id, output_message)
+# triggered when "livingonmars:nextStep" is detected in STATE 3.1 or 3.2
+def next_step(hermes, intent_message, session):
+    # increase the current step to move to the next
+    session.current_step += 1
+    trace.debug("The current step is: %d", session.current_step)
+
+    if session.state == 1:
+        # Go to STATE 3.2: Following the Steps
+        session.state = 2
+        trace.info("STATE 3.2: Following the Steps")
+        output_message = session.step_message("next_from_first")
+
+    elif session.current_step == session.total_steps:
+        # Go to STATE 3.3: The Last Step
+        session.state = 3
+        trace.info("STATE 3.3: Last Step")
+        output_message = session.step_message("last")
+    else:
+        # Stay in STATE 3.2: Following the Steps
+        trace.info("STATE 3.2 - STEP %d", session.current_step)
+        output_message = session.step_message("next")
 
-        else:
-            # user said no so the system goes back to the list
-            # Go to STATE 1.1: Listing Available Procedure
-            STAGE = 1
-            STATE = 1
-            print("STATE 1.1: Listing Available Procedure")
-            output_message = get_repeat_message_output()
+    if isConnected():
+        # Sending the instructions to the GUI
+        gui.post("/showstep", session.step.document)
 
-            if isConnected():
-                # go back to procedure list
-                r = requests.get(GUI_ADDR + "/confirm")
+    return hermes.publish_end_session(intent_message.session_id, output_message)
 
-            return hermes.publish_end_session(intent_message.session_id, output_message)
+# triggered when "livingonmars:nextStep" is detected in STATE 3.3
+def next_after_last_step(hermes, intent_message, session):
+    output_message = "That was the last step. Very good! You have finished the experiment. The session ends here. Let's go back to where we started."
+    return end_procedure(hermes, intent_message, session, output_message)
 
-    elif STAGE == 1 and STATE == 2 and intent_message.slots.confirmation.first() == None:
-        # do the confirm again
-        return hermes.publish_continue_session(intent_message.session_id, output_message, [INTENT_CONFIRM])
+# triggered when "livingonmars:previousStep" is detected in STATE 3.1
+def previous_at_first_step(hermes, intent_message, session):
+    trace.info("STATE 3.1: The First Step - current step was not updated")
+    output_message = "You are at the first step of the experiment."
 
     return hermes.publish_end_session(intent_message.session_id, output_message)
 
-# action function that handles the response of the session of the START PROCEDURE intent
-def start_procedure(hermes, intent_message):
-    global STAGE, STATE, current_step, procedure_steps
+# triggered when "livingonmars:previousStep" is detected in STATE 3.2 or 3.3
+def previous_step(hermes, intent_message, session):
+    # decrease the current step to go back
+    session.current_step -= 1
 
-    if STAGE == 0 and STATE == 0:
-        # Go to STATE 1.1: Listing Available Procedure
-        STAGE = 1
-        STATE = 1
-        print("STATE 1.1: Listing Available Procedure")
-        output_message = proceduresListOutput()
-        return hermes.publish_end_session(intent_message.session_id,
-                                          output_message)
-
-    elif STAGE == 2 and STATE == 1:
+    # if previous step is the first one
+    if session.current_step == 1:
         # Go to STATE 3.1: The First Step
-        STAGE = 3
-        STATE = 1
-        print("STATE 3.1: The First Step")
-
-        output_message = get_procedure_steps()
+        session.state = 1
+        trace.info("STATE 3.1: The First Step")
+        output_message = session.step_message("first")
 
-        if isConnected():
-            # Sending the instructions to the GUI
-            r = requests.post(GUI_ADDR + "/showstep",
-                              json=procedure_steps["steps"][current_step - 1])
-
-        return hermes.publish_end_session(intent_message.session_id,
-                                          output_message)
     else:
-        # get the default message for the current stage
-        output_message = get_wrong_intent_message()
-        return hermes.publish_end_session(intent_message.session_id,
-                                          output_message)
-
-# action function that handles the response of the session of the NEXT STEP intent
-def next_step(hermes, intent_message):
-    global STAGE, STATE, total_steps, current_step, procedure_steps
-
-    # condition so that only at this stage the step related variables are updated
-    if STAGE == 3 and (STATE == 1 or STATE == 2):
-        # increase the current step to move to the next
-        current_step += 1
-        print("The current step is: " + str(current_step))
-        # get the description of the next step from the list
-        step_description = procedure_steps["steps"][current_step -
-                                                    1]["description"]
-
-        if STATE == 1:
-            # Go to STATE 3.2: Following the Steps
-            STATE = 2
-            print("STATE 3.2: Following the Steps")
-            print("The current step is: " + str(current_step))
-            output_message = "Here is step {}, out of {}. If you need to hear the previous step, tell me to go back. {}".format(
-                current_step, total_steps, step_description)
-            if isConnected():
-                # Sending the instructions to the GUI
-                r = requests.post(GUI_ADDR + "/showstep",
-                                  json=procedure_steps["steps"][current_step - 1])
-
-        elif STATE == 2:
-            # Check if the current step is the last step
-            if current_step == total_steps:
-                # Go to STATE 3.3: The Last Step
-                STATE = 3
-                print("STATE 3.3: Last Step")
-                output_message = "You are almost done! Please tell me, when you are finished. The last step is. {}".format(
-                    step_description)
-            else:
-                # Stay in STATE 3.2: Following the Steps
-                print("STATE 3.2 - STEP {}".format(current_step))
-                output_message = "Here is step, {}, out of, {}. {}".format(
-                    current_step, total_steps, step_description)
-            if isConnected():
-                # Sending the instructions to the GUI
-                r = requests.post(GUI_ADDR + "/showstep",
-                                  json=procedure_steps["steps"][current_step - 1])
-
-    elif STAGE == 3 and STATE == 3:
-        # Go to STATE FINALE: Finishing the Procedure
-        print("STATE FINALE: Finishing the Procedure")
-        STAGE = 0
-        STATE = 0
-        print("STATE 0.0: Initial")
-
-        output_message = "That was the last step. Very good! You have finished the experiment. The session ends here. Let's go back to where we started."
-
-        # reset all global variables
-        procedures_list = ""
-        selected_procedure = 0
-        selected_procedure_title = ""
-        resources_list = ""
-        current_step = -1
-        procedure_steps = None
-        total_steps = -1
-
-        if isConnected():
-                # send request to GUI API to show the finish screen
-                r = requests.get(GUI_ADDR + "/finish")
+        # Go back or stay in STATE 3.2: Following the Steps
+        trace.info("State 3.%d - STEP %d", session.state, session.current_step)
+        session.state = 2
+        output_message = session.step_message("previous")
 
-        return hermes.publish_end_session(intent_message.session_id,
-                                              output_message)
-    else:
-        print("Stage {}.{} - Wrong intent detected.".format(STAGE, STATE))
-        # get the default message for the current stage
-        output_message = get_wrong_intent_message()
+    if isConnected():
+        # Sending the instructions to the GUI
+        gui.post("/showstep", session.step.document)
 
     return hermes.publish_end_session(intent_message.session_id, output_message)
 
-# triggered when "livingonmars:previousStep" is detected
-def previous_step(hermes, intent_message):
-    global STAGE, STATE, total_steps, current_step, procedure_steps
-    print("Previous Step triggered!")
-
-    if STAGE == 3 and STATE == 1:
-        print("STATE 3.1: The First Step - current step was not updated")
-        output_message = "You are at the first step of the experiment."
-
-    # condition so that only at this stage and states the step related variables are updated
-    elif STAGE == 3 and (STATE == 2 or STATE == 3):
-        # decrease the current step to go back
-        current_step -= 1
-
-        # get the description of the step from the list
-        step_description = procedure_steps["steps"][current_step -
-                                                    1]["description"]
-
-        # if previous step is the first one
-        if current_step == 1:
-            # Go to STATE 3.1: The First Step
-            STATE = 1
-            print("STATE 3.1: The First Step")
-            output_message = "Alright! Here is the first step: {}".format(
-                step_description)
-            if isConnected():
-                # Sending the instructions to the GUI
-                r = requests.post(GUI_ADDR + "/showstep",
-                                  json=procedure_steps["steps"][current_step - 1])
-
-        elif STATE == 2:
-            # Stay in STATE 3.2: Following the Steps
-            print("State 3.2 - STEP {}".format(current_step))
-            output_message = "Here is the previous step. {}".format(step_description)
-            if isConnected():
-                # Sending the instructions to the GUI
-                r = requests.post(GUI_ADDR + "/showstep",
-                                  json=procedure_steps["steps"][current_step - 1])
-
-        elif STATE == 3:
-            # Go back to STATE 3.2: Following the Steps
-            STATE = 2
-            print("State 3.3 - STEP {}".format(current_step))
-            output_message = "Here is the previous step. {}".format(step_description)
-            if isConnected():
-                # Sending the instructions to the GUI
-                r = requests.post(GUI_ADDR + "/showstep",
-                                  json=procedure_steps["steps"][current_step - 1])
-
+# triggered when "livingonmars:finishProcedure" is detected in STATE 3.3
+def finish_procedure(hermes, intent_message, session):
+    output_message = "Very good! You have finished the experiment. The session ends here. Let's go back to where we started."
+    return end_procedure(hermes, intent_message, session, output_message)
+
+# triggered when "livingonmars:finishProcedure" is detected in STATE 3.1 or 3.2
+def finish_before_last_step(hermes, intent_message, session):
+    # increase the current step to move to the next
+    session.current_step += 1
+    trace.debug("The current step is: %d", session.current_step)
+
+    if session.state == 1:
+        # Go to STATE 3.2: Following the Steps
+        session.state = 2
+        trace.info("STATE 3.2: Following the Steps")
+        output_message = session.step_message("finish_from_first")
+
+    elif session.current_step == session.total_steps:
+        # Go to STATE 3.3: The Last Step
+        session.state = 3
+        trace.info("STATE 3.3: Last Step")
+        output_message = session.step_message("last")
     else:
-        print("Stage {}.{} - Wrong intent detected.".format(STAGE, STATE))
-        # get the default message for the current stage
-        output_message = get_wrong_intent_message()
-
-    return hermes.publish_end_session(intent_message.session_id, output_message)
-
-# triggered when "livingonmars:chooseProcedure" is detected
-def finish_procedure(hermes, intent_message):
-    global STAGE, STATE, procedures_list, selected_procedure, selected_procedure_title, resources_list, current_step, procedure_steps, total_steps
+        # Stay in STATE 3.2: Following the Steps
+        trace.info("STATE 3.2 - STEP %d", session.current_step)
+        output_message = session.step_message("finish_early")
 
-    if STAGE == 3 and STATE == 3:
-        # Go to STATE FINALE: Finishing the Procedure
-        print("STATE FINALE: Finishing the Procedure")
-        STAGE = 0
-        STATE = 0
-        print("STATE 0.0: Initial")
-
-        output_message = "Very good! You have finished the experiment. The session ends here. Let's go back to where we started."
+    if isConnected():
+        # Sending the instructions to the GUI
+        gui.post("/showstep", session.step.document)
 
-        # reset all global variables
-        procedures_list = ""
-        selected_procedure = 0
-        selected_procedure_title = ""
-        resources_list = ""
-        current_step = -1
-        procedure_steps = None
-        total_steps = -1
+    return hermes.publish_end_session(intent_message.session_id,
+                                      output_message)
 
-        if isConnected():
-            # send request to GUI API to show the finish screen
-            r = requests.get(GUI_ADDR + "/finish")
+# auxiliary function that goes back to STATE 0.0 after the last step
+def end_procedure(hermes, intent_message, session, output_message):
+    # Go to STATE FINALE: Finishing the Procedure
+    trace.info("STATE FINALE: Finishing the Procedure")
+    session.stage = 0
+    session.state = 0
+    trace.info("STATE 0.0: Initial")
 
-        return hermes.publish_end_session(intent_message.session_id,
-                                          output_message)
-    elif STAGE == 3:
-        # increase the current step to move to the next
-        current_step += 1
-        print("The current step is: " + str(current_step))
-
-        # get the description of the next step from the list
-        step_description = procedure_steps["steps"][current_step -
-                                                    1]["description"]
-
-        if STATE == 1:
-            # Go to STATE 3.2: Following the Steps
-            STATE = 2
-            print("STATE 3.2: Following the Steps")
-            output_message = "Alright, but we are not at the last step yet, so here is the next step. To hear the previous step, tell me to go back. This is step {}, out of {}. {}".format(
-                current_step, total_steps, step_description)
-            if isConnected():
-                # Sending the instructions to the GUI
-                r = requests.post(GUI_ADDR + "/showstep",
-                                  json=procedure_steps["steps"][current_step - 1])
-
-        elif STATE == 2:
-            # Check if the current step is the last step
-            if current_step == total_steps:
-                # Go to STATE 3.3: The Last Step
-                STATE = 3
-                print("STATE 3.3: Last Step")
-                output_message = "You are almost done! Please tell me, when you are finished. The last step is. {}".format(
-                    step_description)
-            else:
-                # Stay in STATE 3.2: Following the Steps
-                print("STATE 3.2 - STEP {}".format(current_step))
-                output_message = "Alright, but we are not at the last step yet, so here is the next step. This is step {}, out of {}. {}".format(
-                    current_step, total_steps, step_description)
-            if isConnected():
-                # Sending the instructions to the GUI
-                r = requests.post(GUI_ADDR + "/showstep",
-                                  json=procedure_steps["steps"][current_step - 1])
+    # forget the procedure data
+    session.reset()
+    procedure_prefetcher.cancel(session.site_id)
 
-    else:
-        print("Stage {}.{} - Wrong intent detected.".format(STAGE, STATE))
-        # get the default message for the current stage
-        output_message = get_wrong_intent_message()
+    if isConnected():
+        # send request to GUI API to show the finish screen
+        gui.get("/finish")
 
     return hermes.publish_end_session(intent_message.session_id,
                                       output_message)
 
 # triggered when "livingonmars:repeat" is detected
-def repeat(hermes, intent_message):
-    print("Repeat intent triggered!")
+def repeat(hermes, intent_message, session):
+    log.info("Repeat intent triggered!")
 
-    output_message = get_repeat_message_output()
+    output_message = get_repeat_message_output(session)
 
     return hermes.publish_end_session(intent_message.session_id,
                                       output_message)
 
 # triggered when "livingonmars:help" is detected
-def help_intent(hermes, intent_message):
-    print("Help intent triggered!")
+def help_intent(hermes, intent_message, session):
+    log.info("Help intent triggered!")
 
-    output_message = get_manual_message_output()
+    output_message = get_manual_message_output(session)
 
     return hermes.publish_end_session(intent_message.session_id,
                                       output_message)
@@ -475,19 +768,16 @@ def help_intent(hermes, intent_message):
 # triggered when "livingonmars:cancelProcedure" is detected
     # TODO Disable the default Cancel command, so that we can apply our custom actions (reset our parameters)
     # https://docs.snips.ai/articles/platform/dialog/multi-turn-dialog/disable-safe-word
-def cancel_procedure(hermes, intent_message):
-
+def cancel_procedure(hermes, intent_message, session):
     output_message = "You are about to go back to where we started. Are you sure?"
 
     if isConnected():
-        r = requests.get(GUI_ADDR + "/cancelconfirm")
+        gui.get("/cancelconfirm")
 
     return hermes.publish_continue_session(intent_message.session_id, output_message, [INTENT_CONFIRM_CANCEL])
 
 # triggered when "livingonmars:confirmExit" is detected
-def confirm_cancel(hermes, intent_message):
-    global STAGE, STATE, procedures_list, selected_procedure, selected_procedure_title, resources_list, current_step, procedure_steps, total_steps
-
+def confirm_cancel(hermes, intent_message, session):
     # check if anything was detected and mapped to a slot
     if intent_message.slots.confirmation.first() != None:
 
@@ -496,28 +786,23 @@ def confirm_cancel(hermes, intent_message):
 
         # check if it's yes
         if raw_choice == "yes":
-            print("STATE 0.0: Initial")
-            # reset all global variables
-            STATE = 0
-            STAGE = 0
-            procedures_list = ""
-            selected_procedure = 0
-            selected_procedure_title = ""
-            resources_list = ""
-            current_step = -1
-            procedure_steps = None
-            total_steps = -1
+            trace.info("STATE 0.0: Initial")
+            session.state = 0
+            session.stage = 0
+            # forget the procedure data
+            session.reset()
+            procedure_prefetcher.cancel(session.site_id)
 
             output_message = "I have stopped the session. We are now going back to the start."
             if isConnected():
-                r = requests.post(GUI_ADDR + "/cancel", json={"cancel": True})
+                gui.post("/cancel", {"cancel": True})
 
             return hermes.publish_end_session(intent_message.session_id, output_message)
         else:
             # the answer was no, so the system repeats the message of the current stage
-            output_message = get_repeat_message_output()
+            output_message = get_repeat_message_output(session)
             if isConnected():
-                r = requests.post(GUI_ADDR + "/cancel", json={"cancel": False})
+                gui.post("/cancel", {"cancel": False})
 
             return hermes.publish_end_session(intent_message.session_id, output_message)
     else:
@@ -525,232 +810,280 @@ def confirm_cancel(hermes, intent_message):
         output_message = "I didn't get that. You are about to go back to where we started. Are you sure?"
         return hermes.publish_continue_session(intent_message.session_id, output_message, [INTENT_CONFIRM_CANCEL])
 
+# triggered when an intent is detected in a state where it makes no sense
+def wrong_intent(hermes, intent_message, session):
+    WRONG_INTENTS.inc(("{}.{}".format(session.stage, session.state),))
+    log.info("Stage %d.%d - Wrong intent detected.", session.stage,
+             session.state)
+    # get the default message for the current stage
+    output_message = get_wrong_intent_message(session)
+
+    return hermes.publish_end_session(intent_message.session_id, output_message)
+
 # auxiliary function to execute all the necessary steps to list procedures
 # returns the STRING outputMessage
-def proceduresListOutput():
-    global procedures_list
+def proceduresListOutput(session):
+    # get procedures data from the catalog cache
+    procedures = catalog.get()
 
-    # get procedures data from the DB API
-    procedures = requests.get(DB_ADDR + "/procedures").json()
+    # create dialogue output for VUI
+    output_message = "I have found, {}, experiments. You can wake me up and tell me the number, of the experiment you want to select. {}".format(
+        len(procedures), procedures_page_output(session, procedures))
 
-    # create the list of procedures with the order number from the JSON
-    total_procedures = 0
-    order_number = 0
-    procedures_list = ""
-    for procedure in procedures:
-        order_number += 1
-        total_procedures += 1
-        procedures_list += str(order_number) + ". " + procedure["title"] + ". "
+    return output_message
 
-    # create dialogue output for VUI
-    output_message = "I have found, {}, experiments. You can wake me up and tell me the number, of the experiment you want to select. Here are the experiments. {} ".format(
-        total_procedures, procedures_list)
+# auxiliary function that reads out and shows the current page of the list
+# returns the STRING outputMessage
+def procedures_page_output(session, procedures):
+    first = session.procedures_page * PROCEDURES_PAGE_SIZE
+    page = procedures[first:first + PROCEDURES_PAGE_SIZE]
+
+    # create the list of the page with the order number from the JSON
+    session.procedures_list = "".join(
+        "{}. {}. ".format(order_number, procedure.title)
+        for order_number, procedure in enumerate(page, first + 1))
+
+    if len(procedures) <= PROCEDURES_PAGE_SIZE:
+        output_message = "Here are the experiments. {} ".format(
+            session.procedures_list)
+    elif len(page) == 1:
+        output_message = "Here is the last experiment. {}".format(
+            session.procedures_list)
+    else:
+        output_message = "Here are the experiments {} to {}. {}".format(
+            first + 1, first + len(page), session.procedures_list)
+
+    if len(procedures) > PROCEDURES_PAGE_SIZE:
+        if first + len(page) < len(procedures):
+            output_message += "To hear the next ones, call me and say next. "
+        if first > 0:
+            output_message += "To hear the previous ones, call me and say previous. "
 
     if isConnected():
-        # request to GUI API to show the list on the screen
-        r = requests.post(GUI_ADDR + "/show", json=procedures)
+        # request to GUI API to show the page on the screen
+        gui.post("/show", [procedure.document for procedure in page])
 
     return output_message
 
 # auxiliary function to get the procedures steps and the output message for the start procedure
 # returns the STRING outputMessage
-def get_procedure_steps():
-    global current_step, procedure_steps
-
-    # The index for the current step. We are always starting with the first step (0 in an array)
-    current_step = 1
-
-    # Getting the steps for the selected procedure from the Database
-    procedure_steps = requests.get(DB_ADDR + "/proceduresteps/" +
-                                   str(selected_procedure)).json()
-
-    # Getting the instructions for the first step
-    first_step = procedure_steps["steps"][current_step - 1]["description"]
+# the session only moves to the first step once it is loaded
+def get_procedure_steps(session):
+    # Getting the steps for the selected procedure into the snapshot, prefetched from the Database
+    try:
+        procedure_prefetcher.get(session.site_id, session.selected_procedure,
+                                 "steps")
+    except DeadlineExceeded as e:
+        # the DB is too slow for this intent, start from the stored steps
+        # while they go on loading
+        if not snapshot.has("/proceduresteps/" + str(session.selected_procedure)):
+            raise
+        log.warning("%s, answering from the snapshot", e)
+
+    # load and render only the first steps, the window follows the current step
+    # We are always starting with the first step
+    window = open_step_window(session, 1)
+    output_message = window.message(1, "start")
+
+    session.steps = None
+    session.current_step = 1
+    session.steps = window
 
     # create dialogue output for VUI
-    output_message = "Let's start! When you are ready for the next step, please say next! Here is the first step. {} ".format(
-        first_step)
-
     return output_message
 
-# auxiliary function to get the output messages for each STAGE and STATE
-def get_repeat_message_output():
-    global STAGE, STATE, procedures_list, selected_procedure_title, resources_list, current_step, procedure_steps
-    output_message = "I don't remember what I just said either... Sorry..."
-
-    # get the message for the stage and state
-    if STAGE == 0 and STATE == 0:
-        print("Repeating message for: STATE 0.0")
-        output_message = "Ask me for help, and I will tell you what you can do!"
-
-    if STAGE == 1 and STATE == 1:
-        print("Repeating message for: STATE 1.1")
-        output_message = "Okay! Please select an experiment, and tell me its number. {}".format(
-            procedures_list)
-
-    if STAGE == 2 and STATE == 1:
-        print("Repeating message for: STATE 2.1")
-        output_message = "Here is what you will need for the experiment, {}. {}. To go on, please call me and say, start experiment.".format(
-            selected_procedure_title, resources_list)
-
-    if STAGE == 3 and STATE == 1:
-        step_description = procedure_steps["steps"][current_step -
-                                                    1]["description"]
-        print("Repeating message for: STATE 3.1")
-        output_message = "Alright! Let me know when you are ready for the next step. Here is the first step: {}".format(
-            step_description)
-
-    if STAGE == 3 and STATE == 2:
-        step_description = procedure_steps["steps"][current_step -
-                                                    1]["description"]
-        print("Repeating message for: STATE 3.2")
-        output_message = "Okay! {}".format(step_description)
-
-    if STAGE == 3 and STATE == 3:
-        step_description = procedure_steps["steps"][current_step -
-                                                    1]["description"]
-        print("Repeating message for: STATE 3.3")
-        output_message = "Alright! Please tell me when you are done. The last step is. {}".format(
-            step_description)
+# the dialogue: (intent, from states, action, to states)
+TRANSITIONS = [
+    (INTENT_HELLO, [INITIAL], hello, [INITIAL]),
+    (INTENT_SHOW, [INITIAL], show_procedures, [LISTING, INITIAL]),
+    (INTENT_CHOOSE, [INITIAL], show_procedures, [LISTING, INITIAL]),
+    (INTENT_START, [INITIAL], show_procedures, [LISTING, INITIAL]),
+    (INTENT_CHOOSE, [LISTING], choose_procedure, [SELECTING, LISTING]),
+    (INTENT_NEXT, [LISTING], next_page, [LISTING]),
+    (INTENT_PREVIOUS, [LISTING], previous_page, [LISTING]),
+    (INTENT_CONFIRM, [SELECTING], confirm_procedure,
+     [INGREDIENTS, LISTING, SELECTING]),
+    (INTENT_START, [INGREDIENTS], start_procedure, [FIRST_STEP, INGREDIENTS]),
+    (INTENT_NEXT, [FIRST_STEP, FOLLOWING], next_step, [FOLLOWING, LAST_STEP]),
+    (INTENT_NEXT, [LAST_STEP], next_after_last_step, [INITIAL]),
+    (INTENT_PREVIOUS, [FIRST_STEP], previous_at_first_step, [FIRST_STEP]),
+    (INTENT_PREVIOUS, [FOLLOWING, LAST_STEP], previous_step,
+     [FIRST_STEP, FOLLOWING]),
+    (INTENT_FINISH, [FIRST_STEP, FOLLOWING], finish_before_last_step,
+     [FOLLOWING, LAST_STEP]),
+    (INTENT_FINISH, [LAST_STEP], finish_procedure, [INITIAL]),
+    (INTENT_REPEAT, ALL_STATES, repeat, []),
+    (INTENT_HELP, ALL_STATES, help_intent, []),
+    (INTENT_CANCEL, ALL_STATES, cancel_procedure, []),
+    (INTENT_CONFIRM_CANCEL, ALL_STATES, confirm_cancel, [INITIAL]),
+]
+
+# actions for the intents that have no transition in the current state
+DEFAULT_ACTIONS = {
+    INTENT_HELLO: wrong_intent,
+    INTENT_SHOW: wrong_intent,
+    INTENT_CHOOSE: wrong_intent,
+    INTENT_CONFIRM: wrong_intent,
+    INTENT_START: wrong_intent,
+    INTENT_NEXT: wrong_intent,
+    INTENT_PREVIOUS: wrong_intent,
+    INTENT_FINISH: wrong_intent,
+}
+
+dialogue = DialogueMachine(ALL_STATES, INITIAL, TRANSITIONS, DEFAULT_ACTIONS)
+
+# output messages for each STAGE and STATE when the user asks to repeat
+REPEAT_MESSAGES = MessageTable({
+    INITIAL: "Ask me for help, and I will tell you what you can do!",
+    LISTING: "Okay! Please select an experiment, and tell me its number. {procedures_list}",
+    INGREDIENTS: "Here is what you will need for the experiment, {selected_procedure_title}. {resources_list}. To go on, please call me and say, start experiment.",
+}, "I don't remember what I just said either... Sorry...")
+
+# what is said for every step, rendered once when the steps are loaded
+STEP_MESSAGES = StepMessages({
+    "start": "Let's start! When you are ready for the next step, please say next! Here is the first step. {description} ",
+    "next_from_first": "Here is step {step}, out of {total_steps}. If you need to hear the previous step, tell me to go back. {description}",
+    "next": "Here is step, {step}, out of, {total_steps}. {description}",
+    "last": "You are almost done! Please tell me, when you are finished. The last step is. {description}",
+    "first": "Alright! Here is the first step: {description}",
+    "previous": "Here is the previous step. {description}",
+    "finish_from_first": "Alright, but we are not at the last step yet, so here is the next step. To hear the previous step, tell me to go back. This is step {step}, out of {total_steps}. {description}",
+    "finish_early": "Alright, but we are not at the last step yet, so here is the next step. This is step {step}, out of {total_steps}. {description}",
+    "repeat_first": "Alright! Let me know when you are ready for the next step. Here is the first step: {description}",
+    "repeat": "Okay! {description}",
+    "repeat_last": "Alright! Please tell me when you are done. The last step is. {description}",
+})
+
+# the step messages repeated in the step states
+REPEAT_STEP_MESSAGES = {
+    FIRST_STEP: "repeat_first",
+    FOLLOWING: "repeat",
+    LAST_STEP: "repeat_last",
+}
+
+# manual messages for each STAGE and STATE
+MANUAL_MESSAGES = MessageTable({
+    INITIAL: "Hi! Let me show you how I can help you. After I finishe talking, you can call me by saying, hey Snips, and ask me to repeat or ask me to stop. Right now, you can call me, and say you want to start an experiment!",
+    LISTING: "We are selecting an experiment to start. After I finishe talking, you can ask me to, select an experiment, repeat the message, or stop the conversation. To select an experiment, tell me its number! To hear more experiments, say next, or previous.",
+    INGREDIENTS: "Right now, I'm telling you the resources you need for this experiment. After I finishe talking, you can ask me to, start the experiment, repeat the message, or to stop.",
+    FIRST_STEP: "We are currently at, the first step, of this experiment. You can ask me to continue to the next step, to repeat the message, or to stop the experiment.",
+    FOLLOWING: "We are currently at, step, {current_step}. You can ask me to, repeat the message, or to stop the experiment. You can also call me, and ask me to go to the previous step, or the next step.",
+    LAST_STEP: "We are currently at, the last step. You can ask me to, repeat the message. You can also call me, and ask me to go to the previous step, or to finishe the experiment!",
+}, "I am lost and I do not know what the hell we are doing either...")
+
+# short messages of contextualisation for when the wrong intent is recognised
+WRONG_INTENT_MESSAGES = MessageTable({
+    INITIAL: "I didn't get that. Right now, you can call me by saying, hey Snips, I want to start an experiment!",
+    LISTING: "I didn't get that. Please call me, and tell me the number or the name of the experiment.",
+    SELECTING: "I didn't get that. You selected {selected_procedure}, {selected_procedure_title}. Is this correct?",
+    INGREDIENTS: "I didn't get that. Right now, you can call me, and let me know when you are ready to start the experiment!",
+    FIRST_STEP: "I didn't get that. Please call me again, and let me know when you want to continue to the next step.",
+    FOLLOWING: "I didn't get that. You can call me, and ask me to go to the previous step, or the next step.",
+    LAST_STEP: "I didn't get that. Please call me again, and ask me to go to the previous step, or to finishe the experiment!",
+}, "I didn't get that.")
+
+# messages for each STAGE and STATE when no intent was recognised at all
+UNRECOGNIZED_MESSAGES = MessageTable({
+    INITIAL: "Sorry, I didn't understand that. Right now, you can call me, by saying, hey Cassy, and say you want to start an experiment!",
+    LISTING: "Sorry, I didn't get it. Please call me, and, tell me the number or the name of the experiment",
+    SELECTING: "Sorry, I didn't understand that. You selected {selected_procedure}, {selected_procedure_title}. Is this correct?",
+    INGREDIENTS: "Sorry, I didn't understand that. Right now, you can call me, and let me know when you are ready to start the experiment!",
+    FIRST_STEP: "I don't understand what you just said, sorry. Please call me again, and let me know when you want to continue to the next step.",
+    FOLLOWING: "Sorry, I didn't get it. You can call me, and ask me to go to the previous step, or, the next step, if you want to.",
+    LAST_STEP: "I didn't understand what you're saying. Please call me again, and ask me to go to the previous step, or, finish the experiment!",
+}, "Sorry, I didn't understand that.")
 
-    return output_message
+# auxiliary function to get the output messages for each STAGE and STATE
+def get_repeat_message_output(session):
+    trace.info("Repeating message for: STATE %d.%d", session.stage,
+               session.state)
+    variant = REPEAT_STEP_MESSAGES.get((session.stage, session.state))
+    if variant is not None:
+        return session.step_message(variant)
+    return REPEAT_MESSAGES.render(session)
 
 # auxiliary function to get the manual messages for each STAGE and STATE
-def get_manual_message_output():
-    global STAGE, STATE, total_steps, current_step
-
-    output_message = "I am lost and I do not know what the hell we are doing either..."
-
-    # get the message for the stage and state
-    if STAGE == 0 and STATE == 0:
-        print("Getting the manual for: STATE 0.0")
-        output_message = "Hi! Let me show you how I can help you. After I finishe talking, you can call me by saying, hey Snips, and ask me to repeat or ask me to stop. Right now, you can call me, and say you want to start an experiment!"
-
-    if STAGE == 1 and STATE == 1:
-        print("Getting the manual for: STATE 1.1")
-        output_message = "We are selecting an experiment to start. After I finishe talking, you can ask me to, select an experiment, repeat the message, or stop the conversation. To select an experiment, tell me its number!"
-
-    if STAGE == 2 and STATE == 1:
-        print("Getting the manual for: STATE 2.1")
-        output_message = "Right now, I'm telling you the resources you need for this experiment. After I finishe talking, you can ask me to, start the experiment, repeat the message, or to stop."
-
-    if STAGE == 3 and STATE == 1:
-        print("Getting the manual for: STATE 3.1")
-        output_message = "We are currently at, the first step, of this experiment. You can ask me to continue to the next step, to repeat the message, or to stop the experiment."
-
-    if STAGE == 3 and STATE == 2:
-        print("Getting the manual for: STATE 3.2")
-        output_message = "We are currently at, step, {}. You can ask me to, repeat the message, or to stop the experiment. You can also call me, and ask me to go to the previous step, or the next step.".format(
-            current_step)
-
-    if STAGE == 3 and STATE == 3:
-        print("Getting the manual for: STATE 3.3")
-        output_message = "We are currently at, the last step. You can ask me to, repeat the message. You can also call me, and ask me to go to the previous step, or to finishe the experiment!"
-
-    return output_message
+def get_manual_message_output(session):
+    trace.info("Getting the manual for: STATE %d.%d", session.stage,
+               session.state)
+    return MANUAL_MESSAGES.render(session)
 
 # get the short message of contextualisation for when the wrong intent is recognised
-def get_wrong_intent_message():
-    global STAGE, STATE, selected_procedure, procedures, total_steps, current_step
-
-    if STAGE == 0 and STATE == 0:
-        print("WRONG INTENT RECOGNIZED, STATE 0.0")
-        output_message = "I didn't get that. Right now, you can call me by saying, hey Snips, I want to start an experiment!"
-
-    if STAGE == 1 and STATE == 1:
-        print("WRONG INTENT RECOGNIZED, STATE 1.1")
-        output_message = "I didn't get that. Please call me, and select a number from one to six."
-
-    if STAGE == 1 and STATE == 2:
-        print("WRONG INTENT RECOGNIZED, STATE 1.2")
-        output_message = "I didn't get that. You selected {}, {}. Is this correct?".format(
-            str(selected_procedure),
-            str(procedures[selected_procedure - 1]["title"]))
-
-    if STAGE == 2 and STATE == 1:
-        print("WRONG INTENT RECOGNIZED, STATE 2.1")
-        output_message = "I didn't get that. Right now, you can call me, and let me know when you are ready to start the experiment!".format(
-            selected_procedure_title)
-
-    if STAGE == 3 and STATE == 1:
-        print("WRONG INTENT RECOGNIZED, STATE 3.1")
-        output_message = "I didn't get that. Please call me again, and let me know when you want to continue to the next step.".format(
-            selected_procedure_title)
-
-    if STAGE == 3 and STATE == 2:
-        print("WRONG INTENT RECOGNIZED, STATE 3.2")
-        output_message = "I didn't get that. You can call me, and ask me to go to the previous step, or the next step.".format(
-            current_step)
-
-    if STAGE == 3 and STATE == 3:
-        print("WRONG INTENT RECOGNIZED, STATE 3.3")
-        output_message = "I didn't get that. Please call me again, and ask me to go to the previous step, or to finishe the experiment!".format(
-            current_step)
-
-    return output_message
+def get_wrong_intent_message(session):
+    trace.info("WRONG INTENT RECOGNIZED, STATE %d.%d", session.stage,
+               session.state)
+    return WRONG_INTENT_MESSAGES.render(session)
 
 # method executed when there is an unrecognized intent
-def unrecognizedIntentHandler(hermes, intent_message):
-    global STAGE, STATE, selected_procedure, procedures, total_steps, current_step
-
-    if STAGE == 0 and STATE == 0:
-        print("INTENT NOT RECOGNIZED, STATE 0.0")
-        output_message = "Sorry, I didn't understand that. Right now, you can call me, by saying, hey Cassy, and say you want to start an experiment!"
-
-    if STAGE == 1 and STATE == 1:
-        print("INTENT NOT RECOGNIZED, STATE 1.1")
-        output_message = "Sorry, I didn't get it. Please call me, and, select a number from one to six"
-
-    if STAGE == 1 and STATE == 2:
-        print("INTENT NOT RECOGNIZED, STATE 1.1")
-        output_message = "Sorry, I didn't understand that. You selected {}, {}. Is this correct?".format(
-            str(selected_procedure),
-            str(procedures[selected_procedure - 1]["title"]))
-        return hermes.publish_continue_session(intent_message.session_id, output_message, [INTENT_CONFIRM, INTENT_CANCEL])
-
-    if STAGE == 2 and STATE == 1:
-        print("INTENT NOT RECOGNIZED, STATE 2.1")
-        output_message = "Sorry, I didn't understand that. Right now, you can call me, and let me know when you are ready to start the experiment!".format(
-            selected_procedure_title)
+def unrecognizedIntentHandler(hermes, intent_message, session):
+    UNRECOGNIZED_INTENTS.inc(("{}.{}".format(session.stage, session.state),))
+    trace.info("INTENT NOT RECOGNIZED, STATE %d.%d", session.stage,
+               session.state)
+    output_message = UNRECOGNIZED_MESSAGES.render(session)
 
-    if STAGE == 3 and STATE == 1:
-        print("INTENT NOT RECOGNIZED, STATE 3.1")
-        output_message = "I don't understand what you just said, sorry. Please call me again, and let me know when you want to continue to the next step.".format(
-            selected_procedure_title)
-
-    if STAGE == 3 and STATE == 2:
-        print("INTENT NOT RECOGNIZED, STATE 3.2")
-        output_message = "Sorry, I didn't get it. You can call me, and ask me to go to the previous step, or, the next step, if you want to.".format(
-            current_step)
-
-    if STAGE == 3 and STATE == 3:
-        print("INTENT NOT RECOGNIZED, STATE 3.3")
-        output_message = "I didn't understand what you're saying. Please call me again, and ask me to go to the previous step, or, finish the experiment!".format(
-            current_step)
+    if (session.stage, session.state) == SELECTING:
+        return hermes.publish_continue_session(intent_message.session_id, output_message, [INTENT_CONFIRM, INTENT_CANCEL])
 
     return hermes.publish_end_session(intent_message.session_id,
                                       output_message)
 
-# returns True if HDMI is connected
+# returns True if HDMI is connected, as last seen by the display monitor
 def isConnected():
-    #cmd = ['sudo', 'tvservice', '-s']
-    #proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    #o, e = proc.communicate()
-    # return re.search("^state 0x.*a$", o.decode('ascii'))
-    return True
-
-
-with Hermes(MQTT_ADDR) as h:
-    h.subscribe_intent(INTENT_SHOW, show_procedures) \
-        .subscribe_intent(INTENT_CONFIRM, confirm_procedure) \
-        .subscribe_intent(INTENT_CANCEL, cancel_procedure) \
-        .subscribe_intent(INTENT_CHOOSE, choose_procedure) \
-        .subscribe_intent(INTENT_START, start_procedure) \
-        .subscribe_intent(INTENT_NEXT, next_step) \
-        .subscribe_intent(INTENT_PREVIOUS, previous_step) \
-        .subscribe_intent(INTENT_FINISH, finish_procedure) \
-        .subscribe_intent(INTENT_REPEAT, repeat) \
-        .subscribe_intent(INTENT_HELP, help_intent) \
-        .subscribe_intent(INTENT_CONFIRM_CANCEL, confirm_cancel) \
-        .subscribe_intent(INTENT_HELLO, hello) \
-        .start()
+    return display.connected
+
+
+# reports the holes in the dialogue table
+def check_dialogue():
+    for problem in dialogue.check():
+        log.warning("Dialogue table: %s", problem)
+    for name, table, states in [
+            ("repeat", REPEAT_MESSAGES,
+             [key for key in ALL_STATES if key not in REPEAT_STEP_MESSAGES]),
+            ("manual", MANUAL_MESSAGES, ALL_STATES),
+            ("wrong intent", WRONG_INTENT_MESSAGES, ALL_STATES),
+            ("unrecognized", UNRECOGNIZED_MESSAGES, ALL_STATES)]:
+        for stage, state in table.missing(states):
+            log.warning("Dialogue table: no %s message for STATE %d.%d",
+                        name, stage, state)
+
+# returns the callback of every intent of the dialogue, by intent name
+def intent_callbacks():
+    return dict((intent, with_session(intent, dialogue.handler(intent)))
+                for intent in dialogue.intents())
+
+# starts the background work and serves the intents until the skill is stopped
+def main():
+    from hermes_python.hermes import Hermes
+
+    logs.setup(LOG_LEVEL, queue_size=LOG_QUEUE_SIZE,
+               rate_limited=[trace.name], rate_interval=LOG_RATE_INTERVAL,
+               rate_burst=LOG_RATE_BURST)
+    started = time.monotonic()
+    check_dialogue()
+    restore_sessions()
+    warm_up()
+    snapshot.refresh_in_background(db, SNAPSHOT_REFRESH_INTERVAL,
+                                   procedures_in_use)
+    if METRICS_PORT is not None:
+        metrics.serve("127.0.0.1", METRICS_PORT)
+    if GUI_PUSH_PORT is not None:
+        gui_push.serve("127.0.0.1", GUI_PUSH_PORT)
+
+    callbacks = intent_callbacks()
+    if HANDLER_MODE == "asyncio":
+        runner = AsyncRunner(HANDLER_WORKERS)
+        runner.start()
+        callbacks = dict((intent, runner.wrap(callback))
+                         for intent, callback in callbacks.items())
+
+    with Hermes(MQTT_ADDR) as h:
+        for intent, callback in callbacks.items():
+            h.subscribe_intent(intent, callback)
+        ready = time.monotonic() - started
+        READY_SECONDS.set((), ready)
+        log.info("Ready in %.1f ms", ready * 1000)
+        h.start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+REQUEST_SECONDS = metrics.registry.histogram(
+    "skill_backend_request_seconds",
+    "Duration of the requests to the API servers", ("backend", "method"))
+REQUEST_ERRORS = metrics.registry.counter(
+    "skill_backend_errors_total",
+    "Failed or skipped requests to the API servers", ("backend", "reason"))
+HEDGED_REQUESTS = metrics.registry.counter(
+    "skill_backend_hedged_requests_total",
+    "GET requests sent a second time because the first one was slow, by the "
+    "one which answered first", ("backend", "winner"))
+
+# deadline of the requests of the current thread, see set_deadline()
+_local = threading.local()
+
+
+# raised when a backend cannot be reached, answers with a server error, or is
+# skipped because its circuit breaker is open
+class BackendUnavailable(Exception):
+    pass
+
+
+# raised when the API server refuses the request (a 4xx answer), e.g. for a
+# procedure that is not there anymore, asking again does not help
+class RequestRejected(BackendUnavailable):
+    pass
+
+
+# raises for an answer that is not a success, in place of
+# response.raise_for_status(), so that the callers only have to handle
+# BackendUnavailable
+def check_answer(response, method, path):
+    if 200 <= response.status_code < 300:
+        return
+    error = (RequestRejected if 400 <= response.status_code < 500
+             else BackendUnavailable)
+    raise error("{} {} answered {}".format(method, path, response.status_code))
+
+
+# raised when the deadline of the thread has passed before the backend
+# answered
+class DeadlineExceeded(BackendUnavailable):
+    pass
+
+
+# gives the requests sent from this thread seconds from now to be answered,
+# e.g. the budget of an intent, None for no deadline
+def set_deadline(seconds):
+    _local.deadline = (time.monotonic() + seconds
+                       if seconds is not None else None)
+
+
+def clear_deadline():
+    _local.deadline = None
+
+
+# returns the seconds left until the deadline of this thread (negative once it
+# passed), or None without a deadline
+def remaining():
+    deadline = getattr(_local, "deadline", None)
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+# stops calling a backend after failure_threshold consecutive failures, and
+# lets a single trial request through once reset_timeout seconds have passed
+class CircuitBreaker(object):
+
+    def __init__(self, failure_threshold=3, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    # returns True if a request may be sent to the backend
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running:
+                return False
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    # gives back the trial request let through by allow() without an answer
+    # telling whether the backend is up, e.g. when it ran out of time
+    def release_trial(self):
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+
+# keep-alive HTTP client for one backend API (the DB or the GUI server)
+# every request gets the connect and read timeouts unless it passes its own,
+# cut down to what is left until the deadline of the thread
+# with hedge_after, a GET without an answer after hedge_after seconds is sent
+# once more, and the first answer is taken
+class BackendClient(object):
+
+    def __init__(self, url, pool_size=4, connect_timeout=1.0, read_timeout=3.0,
+                 failure_threshold=3, reset_timeout=10.0, name="backend",
+                 hedge_after=None):
+        self.url = url
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.hedge_after = hedge_after
+        self._hedges = None
+        if hedge_after is not None:
+            # a hedged GET may need two connections, and each worker holds
+            # one until its request is over
+            pool_size *= 2
+            self._hedges = ThreadPoolExecutor(
+                max_workers=pool_size, thread_name_prefix=name + "-get")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    # opens up to connections pooled connections before they are needed, with
+    # HEAD requests sent at the same time, so that the first intents do not
+    # pay for the handshakes
+    # the others are only opened if the first one could be
+    def warm_up(self, connections=1, path="/"):
+        try:
+            self.request("HEAD", path)
+        except BackendUnavailable as e:
+            log.warning("Cannot warm up the connections to %s: %s", self.url, e)
+            return
+
+        def open_connection():
+            try:
+                self.request("HEAD", path)
+            except BackendUnavailable:
+                pass
+
+        threads = [threading.Thread(target=open_connection)
+                   for _ in range(connections - 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def get(self, path, **kwargs):
+        if self.hedge_after is None:
+            return self.request("GET", path, **kwargs)
+        return self._hedged_get(path, kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    # sends the request and returns the response, failing fast while the
+    # backend is known to be down
+    def request(self, method, path, **kwargs):
+        left = remaining()
+        if left is not None and left <= 0:
+            REQUEST_ERRORS.inc((self.name, "deadline"))
+            raise DeadlineExceeded("No time left for {} {}".format(
+                method, path))
+
+        if not self.breaker.allow():
+            REQUEST_ERRORS.inc((self.name, "circuit_open"))
+            raise BackendUnavailable("{} is down, not sending {} {}".format(
+                self.url, method, path))
+
+        timeout = kwargs.setdefault("timeout", self.timeout)
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        if left is not None:
+            kwargs["timeout"] = (min(timeout[0], left), min(timeout[1], left))
+
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.url + path, **kwargs)
+        except requests.Timeout as e:
+            limit = timeout[0] if isinstance(
+                e, requests.ConnectTimeout) else timeout[1]
+            if time.perf_counter() - started < limit:
+                # the limit cut down to the deadline fired, the backend may
+                # only be slower than the intent allows
+                self.breaker.release_trial()
+                REQUEST_ERRORS.inc((self.name, "deadline"))
+                raise DeadlineExceeded("{} {} not answered in time".format(
+                    method, path))
+            self.breaker.record_failure()
+            REQUEST_ERRORS.inc((self.name, "timeout"))
+            raise BackendUnavailable("{} {} failed: {}".format(method, path, e))
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            REQUEST_ERRORS.inc((self.name, "connection"))
+            raise BackendUnavailable("{} {} failed: {}".format(method, path, e))
+        finally:
+            elapsed = time.perf_counter() - started
+            REQUEST_SECONDS.observe((self.name, method), elapsed)
+            metrics.add_phase(self.name, elapsed)
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            REQUEST_ERRORS.inc((self.name, "server_error"))
+            raise BackendUnavailable("{} {} answered {}".format(
+                method, path, response.status_code))
+
+        self.breaker.record_success()
+        return response
+
+    # sends the GET on a worker thread, and once more if it is not answered
+    # after hedge_after seconds, returns the first response
+    # the phase of the intent is the time the calling thread waited, the
+    # workers have no phases of their own
+    def _hedged_get(self, path, kwargs):
+        started = time.perf_counter()
+        try:
+            return self._first_answer(path, kwargs)
+        finally:
+            metrics.add_phase(self.name, time.perf_counter() - started)
+
+    def _first_answer(self, path, kwargs):
+        deadline = getattr(_local, "deadline", None)
+
+        def send():
+            _local.deadline = deadline
+            try:
+                return self.request("GET", path, **kwargs)
+            finally:
+                _local.deadline = None
+
+        first = self._hedges.submit(send)
+        left = remaining()
+        done, _ = wait([first], timeout=self.hedge_after if left is None
+                       else max(min(self.hedge_after, left), 0))
+        if done:
+            return first.result()
+
+        second = self._hedges.submit(send)
+        pending = [first, second]
+        error = None
+        while pending:
+            left = remaining()
+            done, _ = wait(pending, timeout=max(left, 0) if left is not None
+                           else None, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                pending.remove(future)
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                HEDGED_REQUESTS.inc((self.name, "first" if future is first
+                                     else "hedge"))
+                for other in pending:
+                    other.add_done_callback(_close_response)
+                return future.result()
+
+        if not pending:
+            raise error
+        for other in pending:
+            other.add_done_callback(_close_response)
+        REQUEST_ERRORS.inc((self.name, "deadline"))
+        raise DeadlineExceeded("GET {} not answered in time".format(path))
+
+
+# releases the connection of the response of a request nobody waits for
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
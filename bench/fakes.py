@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import importlib.util
+import itertools
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SKILL_FILE = os.path.join(
+    ROOT, "action-livingonmars-showProcedures-livingonmars.Experiment_Procedure.py")
+
+
+# imports the action file as a module, without connecting to MQTT
+def load_skill(name="skill"):
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    spec = importlib.util.spec_from_file_location(name, SKILL_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# value of a slot, as hermes_python gives it
+class FakeSlotValue(object):
+
+    def __init__(self, value):
+        self.value = value
+
+
+# list of the values detected for a slot
+class FakeSlot(object):
+
+    def __init__(self, values):
+        self.values = [FakeSlotValue(value) for value in values]
+
+    def first(self):
+        return self.values[0] if self.values else None
+
+
+# the slots of an intent message, missing slots are empty
+class FakeSlots(object):
+
+    def __init__(self, **slots):
+        self._slots = slots
+
+    def __getattr__(self, name):
+        value = self._slots.get(name)
+        return FakeSlot([] if value is None else [value])
+
+
+# classified intent of an intent message
+class FakeIntent(object):
+
+    def __init__(self, intent_name, confidence_score=1.0):
+        self.intent_name = intent_name
+        self.confidence_score = confidence_score
+
+
+_session_ids = itertools.count(1)
+
+
+# intent message with the fields the handlers read
+class FakeIntentMessage(object):
+
+    def __init__(self, intent_name, site_id="default", session_id=None,
+                 **slots):
+        self.intent = FakeIntent(intent_name)
+        self.site_id = site_id
+        self.session_id = session_id or "session-{}".format(next(_session_ids))
+        self.slots = FakeSlots(**slots)
+
+
+# records what the handlers publish instead of sending it to MQTT
+class FakeHermes(object):
+
+    def __init__(self):
+        self.published = []
+
+    def publish_end_session(self, session_id, text):
+        self.published.append(("end", session_id, text))
+        return self
+
+    def publish_continue_session(self, session_id, text, intent_filter,
+                                 custom_data=None, send_intent_not_recognized=False):
+        self.published.append(("continue", session_id, text))
+        return self
+
+    def publish_start_session_notification(self, site_id, session_initiation_text,
+                                           custom_data=None):
+        self.published.append(("notification", site_id,
+                               session_initiation_text))
+        return self
+
+    # text of the last reply
+    @property
+    def last_text(self):
+        return self.published[-1][2] if self.published else None
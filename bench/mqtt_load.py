@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# drives scripted dialogues for N simulated sites through a local MQTT
+# broker (e.g. Mosquitto) into a running skill, with stub DB and GUI servers
+# on the ports the skill uses, and reports the throughput, the latency until
+# the endSession / continueSession reply, and the error rate
+#
+#   mosquitto -d
+#   python3 bench/mqtt_load.py --sites 1,5,10,20 --dialogues 5 --launch
+#
+# without --launch the skill has to be started separately, after the stubs
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import stubs
+from bench.fakes import SKILL_FILE, load_skill
+from bench.run_bench import dialogue_script, percentile
+
+REPLY_TOPICS = ("hermes/dialogueManager/endSession",
+                "hermes/dialogueManager/continueSession")
+
+
+# intent message as the NLU of Snips publishes it
+def intent_payload(intent, site_id, session_id, slots):
+    return json.dumps({
+        "sessionId": session_id,
+        "customData": None,
+        "siteId": site_id,
+        "input": intent.split(":")[-1],
+        "intent": {"intentName": intent, "confidenceScore": 1.0},
+        "slots": [{
+            "rawValue": str(value),
+            "value": {"kind": "Custom", "value": value},
+            "entity": name,
+            "slotName": name,
+            "range": {"start": 0, "end": len(str(value))},
+            "confidenceScore": 1.0,
+        } for name, value in slots.items()],
+        "asrTokens": [],
+        "asrConfidence": 1.0,
+    })
+
+
+# sends the intents and matches the replies by session id
+class LoadClient(object):
+
+    def __init__(self, host, port):
+        try:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        except AttributeError:
+            # paho-mqtt 1.x
+            self.client = mqtt.Client()
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+
+        self._lock = threading.Lock()
+        # session id -> [event, reply text]
+        self._waiting = {}
+        self._connected = threading.Event()
+
+        self.client.connect(host, port)
+        self.client.loop_start()
+        if not self._connected.wait(10):
+            raise RuntimeError("No answer from the MQTT broker")
+
+    # publishes the intent, returns (seconds until the reply, reply text),
+    # the text is None on timeout
+    def ask(self, intent, site_id, slots, timeout):
+        session_id = str(uuid.uuid4())
+        waiting = [threading.Event(), None]
+        with self._lock:
+            self._waiting[session_id] = waiting
+
+        started = time.perf_counter()
+        self.client.publish("hermes/intent/" + intent,
+                            intent_payload(intent, site_id, session_id, slots))
+        answered = waiting[0].wait(timeout)
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self._waiting.pop(session_id, None)
+        return elapsed, waiting[1] if answered else None
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    def _on_connect(self, client, userdata, flags, *reason):
+        for topic in REPLY_TOPICS:
+            client.subscribe(topic)
+        self._connected.set()
+
+    def _on_message(self, client, userdata, message):
+        try:
+            reply = json.loads(message.payload.decode("utf-8"))
+        except ValueError:
+            return
+        with self._lock:
+            waiting = self._waiting.get(reply.get("sessionId"))
+        if waiting is not None:
+            waiting[1] = reply.get("text") or ""
+            waiting[0].set()
+
+
+# runs the dialogues of every site at the same time, returns the samples as
+# (intent, seconds, error) and the seconds the whole run took
+def run(load_client, sites, dialogues, steps, timeout, error_texts):
+    samples = []
+    samples_lock = threading.Lock()
+
+    def simulate(site_id):
+        collected = []
+        for _ in range(dialogues):
+            for intent, slots in dialogue_script(steps):
+                name = "livingonmars:" + intent
+                elapsed, text = load_client.ask(name, site_id, slots, timeout)
+                error = text is None or any(text.startswith(error_text)
+                                            for error_text in error_texts)
+                collected.append((intent, elapsed, error))
+        with samples_lock:
+            samples.extend(collected)
+
+    threads = [threading.Thread(target=simulate,
+                                args=("load-site-{}".format(number),))
+               for number in range(sites)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def print_level(sites, samples, duration):
+    seconds = sorted(sample[1] for sample in samples)
+    errors = sum(1 for sample in samples if sample[2])
+    print("{:>6} {:>8} {:>10.1f} {:>9.3f} {:>9.3f} {:>9.3f} {:>8.2%}".format(
+        sites, len(samples), len(samples) / duration if duration else 0.0,
+        percentile(seconds, 0.50) * 1000, percentile(seconds, 0.95) * 1000,
+        percentile(seconds, 0.99) * 1000,
+        errors / len(samples) if samples else 0.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="MQTT load test of the skill against stub backends")
+    parser.add_argument("--sites", default="1,5,10",
+                        help="comma separated numbers of concurrent sites")
+    parser.add_argument("--dialogues", type=int, default=5,
+                        help="dialogues per site")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--procedures", type=int, default=6)
+    parser.add_argument("--db-latency", type=float, default=0.0)
+    parser.add_argument("--gui-latency", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=10.0,
+                        help="seconds to wait for a reply")
+    parser.add_argument("--launch", action="store_true",
+                        help="start the skill process after the stubs")
+    parser.add_argument("--startup", type=float, default=5.0,
+                        help="seconds to give the launched skill to start")
+    args = parser.parse_args()
+
+    # the intent names, broker and backend addresses are the skill's own
+    skill = load_skill()
+    intents = set(skill.intent_callbacks())
+    for intent, slots in dialogue_script(args.steps):
+        if "livingonmars:" + intent not in intents:
+            parser.error("The skill does not subscribe to " + intent)
+
+    stubs.serve(stubs.db_app(args.procedures, args.steps, args.db_latency),
+                int(skill.DB_ADDR.rsplit(":", 1)[1]))
+    stubs.serve(stubs.gui_app(args.gui_latency),
+                int(skill.GUI_ADDR.rsplit(":", 1)[1]))
+
+    process = None
+    if args.launch:
+        process = subprocess.Popen([sys.executable, SKILL_FILE])
+        time.sleep(args.startup)
+
+    load_client = LoadClient(skill.MQTT_IP_ADDR, skill.MQTT_PORT)
+    try:
+        print("{:>6} {:>8} {:>10} {:>9} {:>9} {:>9} {:>8}".format(
+            "sites", "intents", "intents/s", "p50 ms", "p95 ms", "p99 ms",
+            "errors"))
+        for sites in [int(level) for level in args.sites.split(",")]:
+            samples, duration = run(load_client, sites, args.dialogues,
+                                    args.steps, args.timeout,
+                                    [skill.DB_UNAVAILABLE_MESSAGE])
+            print_level(sites, samples, duration)
+    finally:
+        load_client.close()
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
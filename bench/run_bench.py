@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# drives scripted dialogues through the intent handlers, in process, against
+# stub DB and GUI servers, and reports the latency and allocations per intent
+#
+#   python3 bench/run_bench.py --dialogues 50 --steps 20 --db-latency 0.01
+#   python3 bench/run_bench.py --save baseline.json
+#   python3 bench/run_bench.py --compare baseline.json --tolerance 1.2
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import stubs
+from bench.fakes import FakeHermes, FakeIntentMessage, load_skill
+
+
+# hello, show, choose, confirm, start, next x N, finish
+def dialogue_script(steps):
+    script = [("hello", {}), ("showProcedures", {}),
+              ("chooseProcedure", {"procedure": "three"}),
+              ("confirmProcedure", {"confirmation": "yes"}),
+              ("startProcedure", {})]
+    script += [("nextStep", {})] * (steps - 1)
+    script += [("finishProcedure", {})]
+    return script
+
+
+# returns the value at the quantile of the sorted list
+def percentile(values, quantile):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(quantile * (len(values) - 1))))
+    return values[index]
+
+
+# runs the dialogues and returns intent -> list of (seconds, bytes allocated)
+def run(skill, callbacks, dialogues, steps, sites, trace):
+    samples = {}
+    hermes = FakeHermes()
+    for number in range(dialogues):
+        site_id = "site-{}".format(number % sites)
+        for intent, slots in dialogue_script(steps):
+            name = "livingonmars:" + intent
+            message = FakeIntentMessage(name, site_id, **slots)
+            if trace:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            callbacks[name](hermes, message)
+            elapsed = time.perf_counter() - started
+            allocated = 0
+            if trace:
+                allocated = tracemalloc.get_traced_memory()[1] - before
+            samples.setdefault(intent, []).append((elapsed, allocated))
+    skill.gui.flush(5)
+    return samples
+
+
+# intent -> {"p50", "p95", "p99" in ms, "alloc" in bytes at the median}
+def summarise(timings, allocations):
+    report = {}
+    for intent, samples in timings.items():
+        seconds = sorted(sample[0] for sample in samples)
+        allocated = sorted(sample[1] for sample in allocations.get(intent, []))
+        report[intent] = {
+            "count": len(seconds),
+            "p50": percentile(seconds, 0.50) * 1000,
+            "p95": percentile(seconds, 0.95) * 1000,
+            "p99": percentile(seconds, 0.99) * 1000,
+            "alloc": percentile(allocated, 0.50),
+        }
+    return report
+
+
+def print_report(report):
+    print("{:<20} {:>6} {:>9} {:>9} {:>9} {:>10}".format(
+        "intent", "count", "p50 ms", "p95 ms", "p99 ms", "alloc B"))
+    for intent, row in report.items():
+        print("{:<20} {:>6} {:>9.3f} {:>9.3f} {:>9.3f} {:>10}".format(
+            intent, row["count"], row["p50"], row["p95"], row["p99"],
+            int(row["alloc"])))
+
+
+# returns the intents whose p95 got slower than tolerance x the baseline
+def regressions(report, baseline, tolerance):
+    slower = []
+    for intent, row in report.items():
+        before = baseline.get(intent)
+        if before and row["p95"] > before["p95"] * tolerance:
+            slower.append("{}: p95 {:.3f} ms, was {:.3f} ms".format(
+                intent, row["p95"], before["p95"]))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="In-process benchmark of the intent handlers")
+    parser.add_argument("--dialogues", type=int, default=20)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--procedures", type=int, default=6)
+    parser.add_argument("--sites", type=int, default=1)
+    parser.add_argument("--db-latency", type=float, default=0.0)
+    parser.add_argument("--gui-latency", type=float, default=0.0)
+    parser.add_argument("--save", help="write the report as JSON")
+    parser.add_argument("--compare", help="JSON report to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.2)
+    args = parser.parse_args()
+
+    db_server = stubs.serve(stubs.db_app(args.procedures, args.steps,
+                                         args.db_latency))
+    gui_server = stubs.serve(stubs.gui_app(args.gui_latency))
+
+    skill = load_skill()
+    skill.db.url = "http://127.0.0.1:{}".format(db_server.server_port)
+    skill.gui_client.url = "http://127.0.0.1:{}".format(gui_server.server_port)
+    workdir = tempfile.mkdtemp(prefix="skill-bench-")
+    skill.snapshot.filename = os.path.join(workdir, "snapshot.sqlite")
+    callbacks = skill.intent_callbacks()
+
+    # warm up the connections, then time without and count with tracemalloc
+    run(skill, callbacks, 1, args.steps, args.sites, False)
+    timings = run(skill, callbacks, args.dialogues, args.steps, args.sites,
+                  False)
+    tracemalloc.start()
+    allocations = run(skill, callbacks, args.dialogues, args.steps,
+                      args.sites, True)
+    tracemalloc.stop()
+
+    report = summarise(timings, allocations)
+    print_report(report)
+
+    if args.save:
+        with open(args.save, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            slower = regressions(report, json.load(baseline_file),
+                                 args.tolerance)
+        for line in slower:
+            print("REGRESSION " + line)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
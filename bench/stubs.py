@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import bottle
+
+
+class _ThreadingServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+# runs the bottle app on a free local port in a background thread, returns
+# the server, its address is "http://127.0.0.1:{server.server_port}"
+def serve(app, port=0):
+    server = make_server("127.0.0.1", port, app,
+                         server_class=_ThreadingServer,
+                         handler_class=_QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, name="stub-server")
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+# stub of the DB API with procedures procedures of steps steps each
+# latency seconds are added to every answer
+def db_app(procedures=6, steps=20, latency=0.0):
+    app = bottle.Bottle()
+    catalog = [{"id": number, "title": "Analyse sample number {}".format(number),
+                "last_used_date": None}
+               for number in range(1, procedures + 1)]
+    catalog_body = json.dumps(catalog)
+
+    def answer(document):
+        if latency:
+            time.sleep(latency)
+        bottle.response.content_type = "application/json"
+        return document if isinstance(document, str) else json.dumps(document)
+
+    @app.get("/procedures")
+    def list_procedures():
+        return answer(catalog_body)
+
+    @app.get("/procedures/<procedure_id:int>")
+    def get_procedure(procedure_id):
+        return answer({
+            "procedure": catalog[procedure_id - 1],
+            "stepsCount": steps,
+            "resources": [{"title": "resource {}".format(number)}
+                          for number in range(1, 6)],
+        })
+
+    @app.get("/proceduresteps/<procedure_id:int>")
+    def get_steps(procedure_id):
+        return answer({"steps": [
+            {"id": number, "procedure_id": procedure_id, "step_number": number,
+             "description": "Do step {} of procedure {} carefully.".format(
+                 number, procedure_id)}
+            for number in range(1, steps + 1)]})
+
+    return app
+
+
+# stub of the GUI API that accepts every update, after latency seconds
+def gui_app(latency=0.0):
+    app = bottle.Bottle()
+    app.received = []
+
+    @app.route("/<path>", method=["GET", "POST"])
+    def update(path):
+        if latency:
+            time.sleep(latency)
+        app.received.append(path)
+        return "OK"
+
+    return app
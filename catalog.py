@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import codecs
+import json
+import logging
+import re
+import threading
+import time
+
+import metrics
+from backend import BackendUnavailable, check_answer
+from model import Procedure
+
+log = logging.getLogger(__name__)
+
+CACHE_LOOKUPS = metrics.registry.counter(
+    "skill_cache_lookups_total", "Lookups in the caches of the DB API answers",
+    ("cache", "result"))
+
+WHITESPACE = re.compile(r"\s*")
+# a number or a literal, it ends where the next value starts
+SCALAR = re.compile(r"[^\s,\]]+")
+
+
+# parses a JSON array from an iterable of text chunks, yielding its elements
+# one at a time, so that the whole answer is never held as one string
+# a number or literal at the end of a chunk may go on in the next one, so it
+# is only yielded once the "," or "]" after it came
+def iter_json_array(chunks):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    # what comes next: "[", "value" (or "]" in an empty array), "," or "]"
+    # after a value, nothing once the array is closed
+    expected = "["
+    for chunk in chunks:
+        buffer += chunk
+        position = 0
+        while True:
+            position = WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            char = buffer[position]
+
+            if expected == "[":
+                if char != "[":
+                    raise ValueError("Not a JSON array")
+                expected = "first"
+                position += 1
+            elif not expected:
+                raise ValueError("Data after the JSON array")
+            elif char == "]" and expected != "value":
+                expected = ""
+                position += 1
+            elif expected == ",":
+                if char != ",":
+                    raise ValueError("Expected , or ] in the JSON array")
+                expected = "value"
+                position += 1
+            else:
+                if char in "[{\"":
+                    try:
+                        element, end = decoder.raw_decode(buffer, position)
+                    except ValueError:
+                        # the element goes on in the next chunk
+                        break
+                else:
+                    token = SCALAR.match(buffer, position)
+                    if token is None:
+                        raise ValueError("Expected a value in the JSON array")
+                    if token.end() == len(buffer):
+                        break
+                    element, end = decoder.raw_decode(buffer, position)
+                    if end != token.end():
+                        raise ValueError("Invalid value {} in the JSON "
+                                         "array".format(token.group()))
+                yield element
+                expected = ","
+                position = end
+        buffer = buffer[position:]
+    if expected:
+        raise ValueError("JSON array not closed")
+
+
+# text chunks of a streamed response
+def iter_text(response, chunk_size=65536):
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+    for chunk in response.iter_content(chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", True)
+
+
+# shared cache for the procedures list of the DB API
+# entries younger than ttl are served from memory, older entries are served
+# stale while a background thread revalidates them with If-None-Match /
+# If-Modified-Since, and entries older than ttl + max_stale are refetched
+# before answering, unless the DB API is down and there is no fresher list
+# with a snapshot, load_snapshot() starts the list from the stored copy
+# (served stale and revalidated at once) and every new list is stored there
+# with build_index, get_index() returns build_index(list), built once per list
+# the list is a tuple of model.Procedure, parsed once from the answer
+class ProcedureCatalog(object):
+
+    def __init__(self, client, path, ttl=60, max_stale=600, snapshot=None,
+                 build_index=None):
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.snapshot = snapshot
+        self.build_index = build_index
+
+        self._lock = threading.Lock()
+        self._procedures = None
+        self._etag = None
+        self._last_modified = None
+        self._fetched_at = 0.0
+        self._refreshing = False
+        # the list the index was built for, and the index
+        self._indexed = None
+        self._index = None
+
+    # takes the stored list of the snapshot when nothing was loaded yet
+    def load_snapshot(self):
+        if self.snapshot is None:
+            return
+        procedures = self._stored()
+        if procedures is None:
+            return
+        headers = self.snapshot.validators(self.path)
+        with self._lock:
+            if self._procedures is not None:
+                return
+            self._procedures = procedures
+            self._etag = headers.get("If-None-Match")
+            self._last_modified = headers.get("If-Modified-Since")
+            self._fetched_at = time.monotonic() - self.ttl
+
+    # returns the list of procedures, going to the network only when needed
+    def get(self):
+        with self._lock:
+            procedures = self._procedures
+            age = time.monotonic() - self._fetched_at
+
+        if procedures is not None and age < self.ttl:
+            CACHE_LOOKUPS.inc(("catalog", "hit"))
+            return procedures
+
+        if procedures is not None and age < self.ttl + self.max_stale:
+            CACHE_LOOKUPS.inc(("catalog", "stale"))
+            self._refresh_in_background()
+            return procedures
+
+        CACHE_LOOKUPS.inc(("catalog", "miss"))
+        try:
+            return self.refresh()
+        except BackendUnavailable:
+            if procedures is None and self.snapshot is not None:
+                procedures = self._stored()
+            if procedures is None:
+                raise
+            log.warning("DB unreachable, serving the expired procedures list")
+            return procedures
+
+    # returns the index of the current list, building it if the list changed
+    def get_index(self):
+        procedures = self.get()
+        with self._lock:
+            if self._indexed is procedures:
+                return self._index
+
+        index = self.build_index(procedures)
+        with self._lock:
+            self._indexed = procedures
+            self._index = index
+        return index
+
+    # revalidates the cached list against the DB API and returns it
+    def refresh(self):
+        with self._lock:
+            headers = {}
+            if self._procedures is not None:
+                if self._etag:
+                    headers["If-None-Match"] = self._etag
+                if self._last_modified:
+                    headers["If-Modified-Since"] = self._last_modified
+
+        response = self.client.get(self.path, headers=headers, stream=True)
+        try:
+            with self._lock:
+                if (response.status_code == 304 and
+                        self._procedures is not None):
+                    # nothing changed on the server, only renew the entry
+                    self._fetched_at = time.monotonic()
+                    return self._procedures
+
+            check_answer(response, "GET", self.path)
+            procedures = tuple(Procedure.from_json(procedure) for procedure
+                               in iter_json_array(iter_text(response)))
+        finally:
+            response.close()
+
+        with self._lock:
+            self._procedures = procedures
+            self._etag = response.headers.get("ETag")
+            self._last_modified = response.headers.get("Last-Modified")
+            self._fetched_at = time.monotonic()
+
+        if self.snapshot is not None:
+            self.snapshot.put(self.path,
+                              [procedure.document for procedure in procedures],
+                              self._etag, self._last_modified)
+        return procedures
+
+    # the list stored in the snapshot, or None
+    def _stored(self):
+        procedures = self.snapshot.get(self.path)
+        if procedures is None:
+            return None
+        return tuple(Procedure.from_json(procedure) for procedure in procedures)
+
+    # drops the cached list, the next get() goes to the DB API
+    def invalidate(self):
+        with self._lock:
+            self._procedures = None
+            self._etag = None
+            self._last_modified = None
+            self._fetched_at = 0.0
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        thread = threading.Thread(target=self._background_refresh,
+                                  name="catalog-refresh")
+        thread.daemon = True
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # keep serving the stale list, the next get() will try again
+            log.warning("Catalog refresh failed: %s", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import threading
+
+import metrics
+
+DUPLICATE_INTENTS = metrics.registry.counter(
+    "skill_duplicate_intents_total",
+    "Intents delivered again for a dialogue session, answered with the reply "
+    "given the first time", ("intent",))
+
+
+# the replies of the last intents, by (session id, intent, slot values), so
+# that an intent delivered twice, e.g. redelivered by MQTT, is answered again
+# without running its handler a second time
+# the slot values tell the same intent message from a new answer to a
+# session that asked the same intent again
+# the least recently used replies are dropped beyond max_entries
+class ReplyCache(object):
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._replies = collections.OrderedDict()
+
+    # returns the reply recorded by RecordingHermes, or None
+    def get(self, key):
+        with self._lock:
+            reply = self._replies.get(key)
+            if reply is not None:
+                self._replies.move_to_end(key)
+            return reply
+
+    def put(self, key, reply):
+        with self._lock:
+            self._replies[key] = reply
+            self._replies.move_to_end(key)
+            while len(self._replies) > self.max_entries:
+                self._replies.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._replies)
+
+
+# wraps the Hermes client of an intent handler to keep the reply to the
+# session, as (method name, arguments after the session id)
+class RecordingHermes(object):
+
+    def __init__(self, hermes):
+        self._hermes = hermes
+        self.reply = None
+
+    def __getattr__(self, name):
+        return getattr(self._hermes, name)
+
+    def publish_end_session(self, session_id, *args, **kwargs):
+        self._hermes.publish_end_session(session_id, *args, **kwargs)
+        self.reply = ("publish_end_session", args, kwargs)
+        return self
+
+    def publish_continue_session(self, session_id, *args, **kwargs):
+        self._hermes.publish_continue_session(session_id, *args, **kwargs)
+        self.reply = ("publish_continue_session", args, kwargs)
+        return self
+
+
+# publishes a reply kept by RecordingHermes again to the session
+def replay(hermes, session_id, reply):
+    method, args, kwargs = reply
+    return getattr(hermes, method)(session_id, *args, **kwargs)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# table-driven dialogue state machine
+# transitions are rows of (intent, source states, action, target states), where
+# a state is a (stage, state) pair and the action is called as
+# action(hermes, intent_message, session) and moves the session to one of
+# the target states itself
+# intents without a row for the current state run their default action
+class DialogueMachine(object):
+
+    def __init__(self, states, initial, transitions, defaults):
+        self.states = tuple(states)
+        self.initial = initial
+        self.transitions = tuple(transitions)
+        self.defaults = dict(defaults)
+
+        # (intent, stage, state) -> action
+        self._actions = {}
+        for intent, sources, action, targets in self.transitions:
+            for stage, state in sources:
+                if (intent, stage, state) in self._actions:
+                    raise ValueError("Two transitions for {} in STATE {}.{}"
+                                     .format(intent, stage, state))
+                self._actions[(intent, stage, state)] = action
+
+    # returns the names of the intents known to the machine
+    def intents(self):
+        intents = []
+        for intent in [row[0] for row in self.transitions] + list(self.defaults):
+            if intent not in intents:
+                intents.append(intent)
+        return intents
+
+    # returns the action for the intent in the current state of the session
+    def action(self, intent, session):
+        action = self._actions.get((intent, session.stage, session.state))
+        if action is None:
+            action = self.defaults[intent]
+        return action
+
+    # returns the intent callback, to be wrapped by with_session()
+    def handler(self, intent):
+        def handle(hermes, intent_message, session):
+            return self.action(intent, session)(hermes, intent_message, session)
+        handle.__name__ = intent.split(":")[-1]
+        return handle
+
+    # returns a list of problems in the table: states that cannot be reached
+    # from the initial state, and intents that have no action in some state
+    def check(self):
+        problems = []
+
+        reachable = set([self.initial])
+        pending = [self.initial]
+        while pending:
+            current = pending.pop()
+            for intent, sources, action, targets in self.transitions:
+                if current in sources:
+                    for target in targets:
+                        if target not in reachable:
+                            reachable.add(target)
+                            pending.append(target)
+
+        for stage, state in self.states:
+            if (stage, state) not in reachable:
+                problems.append("STATE {}.{} cannot be reached".format(stage,
+                                                                     state))
+
+        for intent in self.intents():
+            if intent in self.defaults:
+                continue
+            for stage, state in self.states:
+                if (intent, stage, state) not in self._actions:
+                    problems.append("{} has no action in STATE {}.{}".format(
+                        intent, stage, state))
+
+        for intent, sources, action, targets in self.transitions:
+            for stage, state in list(sources) + list(targets):
+                if (stage, state) not in self.states:
+                    problems.append("{} uses the unknown STATE {}.{}".format(
+                        intent, stage, state))
+
+        return problems
+
+
+# output messages by (stage, state), formatted with the fields of the session,
+# e.g. "Here is step {current_step}" reads session.current_step
+class MessageTable(object):
+
+    def __init__(self, templates, default):
+        self.templates = dict(templates)
+        self.default = default
+        self._compiled = dict((key, template.format_map)
+                              for key, template in self.templates.items())
+        self._compiled_default = default.format_map
+
+    def render(self, session):
+        render = self._compiled.get((session.stage, session.state),
+                                    self._compiled_default)
+        return render(_SessionFields(session))
+
+    # returns the states of the list that have no message of their own
+    def missing(self, states):
+        return [key for key in states if key not in self.templates]
+
+
+# lets str.format_map() read the attributes of the session
+class _SessionFields(dict):
+
+    def __init__(self, session):
+        dict.__init__(self)
+        self.session = session
+
+    def __missing__(self, key):
+        return getattr(self.session, key)
+
+
+# utterances of the steps of a procedure, rendered for every step as soon as
+# the step is loaded, so that moving between steps is only a lookup
+# templates are formatted with {step}, {total_steps} and {description}
+class StepMessages(object):
+
+    def __init__(self, templates):
+        self.templates = dict((variant, template.format)
+                              for variant, template in templates.items())
+
+    # returns variant -> utterance of one step
+    def render(self, number, total_steps, description):
+        return dict((variant, render(step=number, total_steps=total_steps,
+                                     description=description))
+                    for variant, render in self.templates.items())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+import subprocess
+import threading
+
+log = logging.getLogger(__name__)
+
+
+# state flags reported by tvservice -s
+HDMI_UNPLUGGED = 0x1
+HDMI_ATTACHED = 0x2
+
+STATE_PATTERN = re.compile(r"^state (0x[0-9a-fA-F]+)")
+
+
+# watches whether a display is attached, so that the intent handlers can read
+# the last known answer instead of running tvservice for every GUI request
+# the probe runs on a background thread every interval seconds, and when the
+# probe command is not available (e.g. not on a Raspberry Pi) the display is
+# assumed to be attached
+class DisplayMonitor(object):
+
+    def __init__(self, command=("sudo", "tvservice", "-s"), interval=5.0,
+                 timeout=2.0):
+        self.command = list(command)
+        self.interval = interval
+        self.timeout = timeout
+
+        # read without a lock, it is only ever replaced by the probe thread
+        self.connected = True
+
+        # True while the probe command fails, to only log the first failure
+        self._failing = False
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    # probes once and then keeps probing in the background
+    def start(self):
+        if self._thread is not None:
+            return
+        self.probe()
+        self._thread = threading.Thread(target=self._run, name="display-probe")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # runs the probe command and updates connected, returns False when the
+    # command cannot be run at all
+    # when the command fails or takes too long, the last known answer is
+    # kept until the next probe
+    def probe(self):
+        try:
+            output = subprocess.check_output(self.command,
+                                             stderr=subprocess.STDOUT,
+                                             timeout=self.timeout)
+        except OSError as e:
+            log.warning("Cannot probe the display, assuming it is attached: "
+                        "%s", e)
+            self.connected = True
+            return False
+        except subprocess.CalledProcessError as e:
+            if not self._failing:
+                log.warning("Probing the display failed, keeping the last "
+                            "answer: %s", e)
+            self._failing = True
+            return True
+        except subprocess.TimeoutExpired:
+            return True
+        self._failing = False
+
+        match = STATE_PATTERN.search(output.decode("ascii", "replace"))
+        if match is None:
+            return True
+
+        state = int(match.group(1), 16)
+        connected = bool(state & HDMI_ATTACHED) and not state & HDMI_UNPLUGGED
+        if connected != self.connected:
+            log.info("Display %s", "attached" if connected else "detached")
+        self.connected = connected
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.probe():
+                # nothing to watch on this machine
+                return
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+import threading
+import time
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+DROPPED_UPDATES = metrics.registry.counter(
+    "skill_gui_dropped_updates_total",
+    "GUI updates dropped because the queue was full or they were superseded",
+    ("reason",))
+
+
+# sends the updates for the GUI API from a background thread, so that a slow
+# or hanging GUI server never delays the spoken reply
+# updates are sent in the order they were queued, and an update for one of the
+# coalesce endpoints replaces the update of that endpoint queued right before
+# with a push.PushChannel, the updates go over it instead of the GUI API
+# while a GUI is connected to it
+class GuiDispatcher(object):
+
+    def __init__(self, client, max_pending=32,
+                 coalesce=("/showstep", "/select", "/show"), push=None):
+        self.client = client
+        self.max_pending = max_pending
+        self.coalesce = frozenset(coalesce)
+        self.push = push
+
+        self._pending = collections.deque()
+        self._busy = False
+        self._condition = threading.Condition()
+
+        # started with the first update or by start()
+        self._thread = None
+
+    # queues a GET request to the GUI API
+    def get(self, path):
+        self._submit("GET", path, None)
+
+    # queues a POST request with a JSON payload to the GUI API
+    def post(self, path, payload=None):
+        self._submit("POST", path, payload)
+
+    # waits until every queued update was sent, returns False on timeout
+    def flush(self, timeout=None):
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._busy, timeout)
+
+    # starts the sender thread, which is otherwise started by the first update
+    def start(self):
+        with self._condition:
+            self._start()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name="gui-dispatch")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _submit(self, method, path, payload):
+        started = time.perf_counter()
+        if self.push is not None and self.push.publish(path, payload, method):
+            metrics.add_phase("gui", time.perf_counter() - started)
+            return
+
+        with self._condition:
+            self._start()
+
+            if path in self.coalesce:
+                # only the latest of the waiting updates of this endpoint is
+                # worth showing, as long as no other update was queued after it
+                while self._pending and self._pending[-1][:2] == (method, path):
+                    self._pending.pop()
+                    DROPPED_UPDATES.inc(("superseded",))
+
+            if len(self._pending) >= self.max_pending:
+                dropped = self._pending.popleft()
+                DROPPED_UPDATES.inc(("queue_full",))
+                log.warning("GUI queue full, dropping %s %s", dropped[0],
+                            dropped[1])
+
+            self._pending.append((method, path, payload))
+            self._condition.notify_all()
+        metrics.add_phase("gui", time.perf_counter() - started)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                method, path, payload = self._pending.popleft()
+                self._busy = True
+
+            try:
+                self.client.request(method, path, json=payload)
+            except Exception as e:
+                log.warning("GUI request %s %s failed: %s", method, path, e)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
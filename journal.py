@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+
+# write-ahead journal of the session states, one JSON line per change
+# lines are written at once but only fsynced every fsync_interval seconds, and
+# once compact_after lines were appended the file is rewritten with only the
+# latest line of every site
+class SessionJournal(object):
+
+    def __init__(self, filename, fsync_interval=0.5, compact_after=1000):
+        self.filename = filename
+        self.fsync_interval = fsync_interval
+        self.compact_after = compact_after
+
+        self._lock = threading.Lock()
+        # site id -> latest record
+        self._latest = {}
+        self._appended = 0
+        self._dirty = False
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # reads the journal back, returns site id -> latest record, and opens it
+    # for appending
+    def replay(self):
+        latest = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, "r") as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line may be cut short by the crash
+                        continue
+                    if entry.get("record") is None:
+                        latest.pop(entry["site"], None)
+                    else:
+                        latest[entry["site"]] = entry["record"]
+
+        with self._lock:
+            self._latest = latest
+            self._compact()
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name="journal-fsync")
+            self._thread.daemon = True
+            self._thread.start()
+
+        return dict(latest)
+
+    # appends the state of the site, unless it did not change
+    def record(self, site_id, record):
+        with self._lock:
+            if self._file is None or self._latest.get(site_id) == record:
+                return
+            self._latest[site_id] = record
+            self._append({"site": site_id, "record": record})
+
+    # appends that the site has no session anymore
+    def forget(self, site_id):
+        with self._lock:
+            if self._file is None or site_id not in self._latest:
+                return
+            del self._latest[site_id]
+            self._append({"site": site_id, "record": None})
+
+    # writes the pending lines to the disk
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._file.flush()
+        self._dirty = True
+        self._appended += 1
+        if self._appended >= self.compact_after:
+            self._compact()
+
+    def _sync(self):
+        if self._dirty and self._file is not None:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    # rewrites the journal with the latest record of every site
+    def _compact(self):
+        if self._file is not None:
+            self._file.close()
+
+        temporary = self.filename + ".tmp"
+        with open(temporary, "w") as journal_file:
+            for site_id, record in self._latest.items():
+                journal_file.write(json.dumps({"site": site_id,
+                                               "record": record},
+                                              separators=(",", ":")) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(temporary, self.filename)
+
+        self._file = open(self.filename, "a")
+        self._appended = 0
+        self._dirty = False
+
+    def _run(self):
+        while not self._stop.wait(self.fsync_interval):
+            try:
+                self.sync()
+            except OSError as e:
+                log.error("Syncing the session journal failed: %s", e)
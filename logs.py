@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+import metrics
+
+FORMAT = ("%(asctime)s %(levelname)s %(name)s "
+          "[site=%(site)s session=%(session)s] %(message)s")
+
+DROPPED_RECORDS = metrics.registry.counter(
+    "skill_log_records_dropped_total",
+    "Log records not written because they were rate limited or the queue "
+    "was full", ("reason",))
+
+# site and dialogue session of the intent handled by the current thread
+_context = threading.local()
+
+
+def set_context(site_id, session_id=None):
+    _context.site = site_id
+    _context.session = session_id
+
+
+def clear_context():
+    _context.site = None
+    _context.session = None
+
+
+# adds the site and session fields to the records, in the thread that logs
+# them
+class ContextFilter(logging.Filter):
+
+    def filter(self, record):
+        record.site = getattr(_context, "site", None) or "-"
+        record.session = getattr(_context, "session", None) or "-"
+        return True
+
+
+# lets at most burst records with the same message template through every
+# interval seconds for each site, only for the loggers given by name
+class RateLimitFilter(logging.Filter):
+
+    def __init__(self, names, interval=1.0, burst=5):
+        super(RateLimitFilter, self).__init__()
+        self.names = tuple(names)
+        self.interval = interval
+        self.burst = burst
+
+        self._lock = threading.Lock()
+        # (logger, template, site) -> [window start, records in the window]
+        self._windows = {}
+
+    def filter(self, record):
+        if not record.name.startswith(self.names):
+            return True
+
+        key = (record.name, record.msg, getattr(record, "site", None))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if len(self._windows) > 1000:
+                    self._windows.clear()
+                self._windows[key] = [now, 1]
+                return True
+            window[1] += 1
+            if window[1] <= self.burst:
+                return True
+        DROPPED_RECORDS.inc(("rate_limited",))
+        return False
+
+
+# queue handler which drops the record instead of blocking or failing when
+# the writer thread is behind
+class _QueueHandler(logging.handlers.QueueHandler):
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED_RECORDS.inc(("queue_full",))
+
+
+# sends the records of every logger through a bounded queue to a background
+# thread writing them to the stream, returns the listener of the queue
+# the records are filtered by level and rate limited before being queued, so
+# that the intent callbacks never wait for the stream
+def setup(level="INFO", stream=None, queue_size=1000, rate_limited=(),
+          rate_interval=1.0, rate_burst=5):
+    records = queue.Queue(maxsize=queue_size)
+
+    handler = _QueueHandler(records)
+    handler.addFilter(ContextFilter())
+    if rate_limited:
+        handler.addFilter(RateLimitFilter(rate_limited, rate_interval,
+                                          rate_burst))
+
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(logging.Formatter(FORMAT))
+    listener = logging.handlers.QueueListener(records, writer)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    for previous in list(root.handlers):
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return listener
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect
+import threading
+import time
+
+# upper bounds in seconds of the latency histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _labels(names, values, extra=""):
+    pairs = ['{}="{}"'.format(name, _escape(value))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# counter by label values, e.g. COUNTER.inc(("db", "timeout"))
+class Counter(object):
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} counter".format(self.name)]
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append("{}{} {}".format(
+                self.name, _labels(self.labelnames, labels), value))
+        return lines
+
+
+# last value by label values, e.g. GAUGE.set((), 0.25)
+class Gauge(object):
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def set(self, labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(labels)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} gauge".format(self.name)]
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append("{}{} {}".format(
+                self.name, _labels(self.labelnames, labels), value))
+        return lines
+
+
+# histogram by label values, e.g. HISTOGRAM.observe(("nextStep",), 0.003)
+class Histogram(object):
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [count per bucket and +Inf, sum]
+        self._values = {}
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1),
+                                                 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            values = [(labels, list(series[0]), series[1])
+                      for labels, series in self._values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            bounds = [repr(float(bound)) for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(
+                    self.name,
+                    _labels(self.labelnames, labels, 'le="{}"'.format(bound)),
+                    cumulative))
+            lines.append("{}_sum{} {}".format(
+                self.name, _labels(self.labelnames, labels), total))
+            lines.append("{}_count{} {}".format(
+                self.name, _labels(self.labelnames, labels), cumulative))
+        return lines
+
+
+# all the metrics of the process, rendered in the Prometheus text format
+# only when scraped
+class Registry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames,
+                                        buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+
+registry = Registry()
+
+
+# time spent in each phase (db, gui, publish) of the intent handled by the
+# current thread
+_phases = threading.local()
+
+
+def start_phases():
+    _phases.current = {}
+
+
+def add_phase(phase, seconds):
+    current = getattr(_phases, "current", None)
+    if current is not None:
+        current[phase] = current.get(phase, 0.0) + seconds
+
+
+def stop_phases():
+    current = getattr(_phases, "current", None)
+    _phases.current = None
+    return current or {}
+
+
+# wraps the hermes object given to the handlers to time the publish calls
+class TimedHermes(object):
+
+    def __init__(self, hermes):
+        self._hermes = hermes
+
+    def __getattr__(self, name):
+        attribute = getattr(self._hermes, name)
+        if not name.startswith("publish"):
+            return attribute
+
+        def publish(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                attribute(*args, **kwargs)
+            finally:
+                add_phase("publish", time.perf_counter() - started)
+            return self
+        return publish
+
+
+# serves GET /metrics on a background thread, returns the server
+# the HTTP server modules are only imported when the endpoint is enabled
+def serve(host="127.0.0.1", port=9464, metrics=registry):
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class MetricsServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = MetricsServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics")
+    thread.daemon = True
+    thread.start()
+    return server
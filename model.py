@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import sys
+
+
+# the texts the handlers read are interned, so that the same title or step
+# description held by the catalog, the prefetched details and the sessions is
+# one string
+def _text(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _compact(document):
+    return json.dumps(document, separators=(",", ":"))
+
+
+# entry of the procedures list of the DB API
+# only the fields the skill reads are kept as attributes, the whole entry is
+# kept as its compact JSON text for the GUI
+class Procedure(object):
+    __slots__ = ("id", "title", "body")
+
+    def __init__(self, id, title, body):
+        self.id = id
+        self.title = title
+        self.body = body
+
+    @classmethod
+    def from_json(cls, document):
+        return cls(document.get("id"), _text(document.get("title")),
+                   _compact(document))
+
+    # the entry as served by the DB API
+    @property
+    def document(self):
+        return json.loads(self.body)
+
+
+# answer of the DB API for /procedures/{id}
+class ProcedureDetail(object):
+    __slots__ = ("id", "title", "steps_count", "resources", "body")
+
+    def __init__(self, id, title, steps_count, resources, body):
+        self.id = id
+        self.title = title
+        self.steps_count = steps_count
+        # titles of the resources, as a tuple
+        self.resources = resources
+        self.body = body
+
+    @classmethod
+    def from_json(cls, document):
+        procedure = document.get("procedure") or {}
+        return cls(procedure.get("id"), _text(procedure.get("title")),
+                   document.get("stepsCount"),
+                   tuple(_text(resource["title"])
+                         for resource in document.get("resources") or ()),
+                   _compact(document))
+
+    @property
+    def document(self):
+        return json.loads(self.body)
+
+
+# one step of the answer of the DB API for /proceduresteps/{id}, numbered
+# from 1, parsed from its JSON text as stored in the snapshot
+class Step(object):
+    __slots__ = ("number", "description", "body")
+
+    def __init__(self, number, description, body):
+        self.number = number
+        self.description = description
+        self.body = body
+
+    @classmethod
+    def from_body(cls, number, body):
+        return cls(number, _text(json.loads(body).get("description")), body)
+
+    @property
+    def document(self):
+        return json.loads(self.body)
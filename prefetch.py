@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from backend import (BackendUnavailable, DeadlineExceeded, RequestRejected,
+                     remaining)
+import metrics
+from catalog import CACHE_LOOKUPS
+
+log = logging.getLogger(__name__)
+
+
+# loads the parts of a procedure (e.g. its detail and its steps) at the same
+# time in the background, so that they are ready when the user confirms the
+# selection and starts the experiment
+# there is one prefetch per site, and a cancelled download cannot be
+# interrupted, its result is just dropped
+class ProcedurePrefetcher(object):
+
+    def __init__(self, loaders, workers=4, phase="db"):
+        # part name -> load(procedure_id), returning what get() returns
+        self._loaders = dict(loaders)
+        # intent phase the time waiting for a prefetch counts in
+        self.phase = phase
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+        self._lock = threading.Lock()
+        # site id -> (procedure id, part name -> future)
+        self._prefetches = {}
+
+    # starts loading every part of the procedure for the site, unless they
+    # are already loading
+    def prefetch(self, site_id, procedure_id):
+        with self._lock:
+            prefetch = self._prefetches.get(site_id)
+            if prefetch is not None and prefetch[0] == procedure_id:
+                return
+            self._cancel(site_id)
+            self._prefetches[site_id] = (procedure_id, dict(
+                (part, self._executor.submit(load, procedure_id))
+                for part, load in self._loaders.items()))
+
+    # forgets the prefetched parts of the site, e.g. when the user changes
+    # their mind
+    def cancel(self, site_id):
+        with self._lock:
+            self._cancel(site_id)
+
+    # returns a part of the procedure, from the prefetch when there is one
+    # waiting for the prefetch at most until the deadline of the thread, when
+    # it raises DeadlineExceeded and the part goes on loading
+    # a prefetch that could not reach the DB is tried once more, other errors
+    # are raised as they are
+    def get(self, site_id, procedure_id, part):
+        with self._lock:
+            prefetch = self._prefetches.get(site_id)
+
+        if prefetch is not None and prefetch[0] == procedure_id:
+            future = prefetch[1][part]
+            CACHE_LOOKUPS.inc((part, "hit" if future.done() else "wait"))
+            left = remaining()
+            started = time.perf_counter()
+            try:
+                return future.result(max(left, 0) if left is not None
+                                     else None)
+            except TimeoutError:
+                CACHE_LOOKUPS.inc((part, "timeout"))
+                raise DeadlineExceeded("Still loading the {} of procedure "
+                                       "{}".format(part, procedure_id))
+            except RequestRejected:
+                raise
+            except BackendUnavailable as e:
+                log.warning("Prefetching the %s of procedure %s failed: %s",
+                            part, procedure_id, e)
+            finally:
+                # the loads run on the workers, the intent only waits for them
+                metrics.add_phase(self.phase, time.perf_counter() - started)
+
+        CACHE_LOOKUPS.inc((part, "miss"))
+        return self._loaders[part](procedure_id)
+
+    def _cancel(self, site_id):
+        prefetch = self._prefetches.pop(site_id, None)
+        if prefetch is not None:
+            for future in prefetch[1].values():
+                future.cancel()
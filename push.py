@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import json
+import logging
+import threading
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+PUSHED_EVENTS = metrics.registry.counter(
+    "skill_gui_push_events_total",
+    "GUI updates sent over the push channel, in full or as a reference to a "
+    "payload the GUI already has", ("event", "encoding"))
+
+# seconds between two keep-alive comments on an idle stream
+KEEPALIVE_INTERVAL = 15.0
+
+
+class _Stream(object):
+
+    def __init__(self):
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        # keys of the payloads already sent on this stream
+        self.known = set()
+
+
+# server-sent events channel to the GUI, served by the skill on one
+# long-lived connection per GUI instead of one request per update
+# every update is an event named after the GUI API endpoint, prefixed with
+# the method for the requests other than POST, e.g.
+#   event: showstep
+#   data: {"key": "9f86d081884c", "data": {...}}
+# for POST /showstep, or event: get:confirm for GET /confirm
+# the payloads POSTed to the keyed endpoints get a key from their content,
+# and once a payload was sent on a stream, the next events with it only carry
+# its key, e.g. data: {"key": "9f86d081884c"}
+class PushChannel(object):
+
+    def __init__(self, max_pending=32,
+                 coalesce=("/showstep", "/select", "/show"),
+                 keyed=("/showstep", "/confirm")):
+        self.max_pending = max_pending
+        self.coalesce = frozenset(coalesce)
+        self.keyed = frozenset(keyed)
+
+        self._lock = threading.Lock()
+        self._streams = []
+
+    # number of connected GUIs
+    @property
+    def clients(self):
+        with self._lock:
+            return len(self._streams)
+
+    # queues the update for every connected GUI, returns False when there is
+    # none, and the update has to go through the GUI API instead
+    def publish(self, path, payload=None, method="POST"):
+        with self._lock:
+            streams = list(self._streams)
+        for stream in streams:
+            with stream.condition:
+                if path in self.coalesce:
+                    while (stream.pending and
+                           stream.pending[-1][:2] == (method, path)):
+                        stream.pending.pop()
+                if len(stream.pending) >= self.max_pending:
+                    stream.pending.popleft()
+                stream.pending.append((method, path, payload))
+                stream.condition.notify()
+        return bool(streams)
+
+    # serves GET /events on a background thread, returns the server
+    def serve(self, host="127.0.0.1", port=4041):
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+
+        channel = self
+
+        class EventsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/events":
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                channel._stream(self.wfile)
+
+            def log_message(self, format, *args):
+                pass
+
+        class EventsServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = EventsServer((host, port), EventsHandler)
+        thread = threading.Thread(target=server.serve_forever,
+                                  name="gui-push")
+        thread.daemon = True
+        thread.start()
+        return server
+
+    # writes the updates to one GUI until it disconnects
+    def _stream(self, output):
+        stream = _Stream()
+        with self._lock:
+            self._streams.append(stream)
+        log.info("GUI connected to the push channel")
+        try:
+            output.write(b"retry: 1000\n\n")
+            output.flush()
+            while True:
+                with stream.condition:
+                    stream.condition.wait_for(lambda: stream.pending,
+                                              KEEPALIVE_INTERVAL)
+                    updates = list(stream.pending)
+                    stream.pending.clear()
+                if not updates:
+                    output.write(b": keep-alive\n\n")
+                for method, path, payload in updates:
+                    output.write(self._encode(stream, method, path, payload))
+                output.flush()
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self._lock:
+                self._streams.remove(stream)
+            log.info("GUI disconnected from the push channel")
+
+    def _encode(self, stream, method, path, payload):
+        event = path.strip("/")
+        if method != "POST":
+            event = method.lower() + ":" + event
+        if method != "POST" or path not in self.keyed or payload is None:
+            message = {"data": payload}
+            encoding = "full"
+        else:
+            key = hashlib.sha1(json.dumps(
+                payload, separators=(",", ":"), sort_keys=True).encode("utf-8")
+            ).hexdigest()[:12]
+            if key in stream.known:
+                message = {"key": key}
+                encoding = "delta"
+            else:
+                if len(stream.known) >= 10000:
+                    stream.known.clear()
+                stream.known.add(key)
+                message = {"key": key, "data": payload}
+                encoding = "full"
+        PUSHED_EVENTS.inc((event, encoding))
+        return "event: {}\ndata: {}\n\n".format(
+            event, json.dumps(message, separators=(",", ":"))).encode("utf-8")
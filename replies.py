@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import time
+
+import metrics
+
+FIRST_REPLY_SECONDS = metrics.registry.histogram(
+    "skill_first_reply_seconds",
+    "Time from the intent until the first part of the reply was sent to the "
+    "TTS", ("intent",))
+FIRST_REPLY_CHARACTERS = metrics.registry.histogram(
+    "skill_first_reply_characters",
+    "Length of the first part of the replies, which the TTS synthesises "
+    "before the user hears anything", ("intent",),
+    buckets=(40, 80, 120, 160, 240, 320, 480, 640))
+REPLY_FOLLOW_UPS = metrics.registry.counter(
+    "skill_reply_follow_ups_total",
+    "Parts of the replies sent as notifications after the first one",
+    ("intent",))
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+CLAUSE_END = re.compile(r"(?<=,)\s+")
+# "3." of "3. Titration. " belongs to the sentence after it
+ORDER_NUMBER = re.compile(r"^\d+\.$")
+
+
+def _pieces(text, budget):
+    pieces = []
+    for sentence in SENTENCE_END.split(text.strip()):
+        if pieces and ORDER_NUMBER.match(pieces[-1]):
+            pieces[-1] += " " + sentence
+        elif len(sentence) > budget:
+            # e.g. a long list of resources, cut after its commas
+            pieces.extend(CLAUSE_END.split(sentence))
+        else:
+            pieces.append(sentence)
+    return pieces
+
+
+# splits the text after whole sentences (or after commas, in a sentence
+# longer than the budget) into parts of at most budget characters, a piece
+# longer than the budget is a part of its own
+def split_reply(text, budget):
+    if not budget or len(text) <= budget:
+        return [text]
+
+    parts = []
+    current = ""
+    for piece in _pieces(text, budget):
+        if current and len(current) + 1 + len(piece) > budget:
+            parts.append(current)
+            current = piece
+        else:
+            current = current + " " + piece if current else piece
+    if current:
+        parts.append(current)
+    return parts
+
+
+# wraps the Hermes client of an intent handler, so that the TTS starts on a
+# short first part of a long reply: publish_end_session() ends the session
+# with the first part, and the other parts follow as notifications to the
+# site, each of them said once the one before is over
+# continue_session replies end with the question the user answers, so they
+# are sent whole
+# budget() returns the characters of the current state of the session
+class ChunkedHermes(object):
+
+    def __init__(self, hermes, intent, site_id, budget, started=None):
+        self._hermes = hermes
+        self._intent = intent
+        self._site_id = site_id
+        self._budget = budget
+        self._started = started if started is not None else time.perf_counter()
+        self._replied = False
+
+    def __getattr__(self, name):
+        return getattr(self._hermes, name)
+
+    def publish_end_session(self, session_id, text):
+        parts = split_reply(text, self._budget())
+        self._hermes.publish_end_session(session_id, parts[0])
+        self._first_reply(parts[0])
+        for part in parts[1:]:
+            REPLY_FOLLOW_UPS.inc((self._intent,))
+            self._hermes.publish_start_session_notification(self._site_id,
+                                                            part, None)
+        return self
+
+    def publish_continue_session(self, session_id, text, *args, **kwargs):
+        self._hermes.publish_continue_session(session_id, text, *args,
+                                              **kwargs)
+        self._first_reply(text)
+        return self
+
+    def _first_reply(self, text):
+        if self._replied:
+            return
+        self._replied = True
+        FIRST_REPLY_SECONDS.observe((self._intent,),
+                                    time.perf_counter() - self._started)
+        FIRST_REPLY_CHARACTERS.observe((self._intent,), len(text))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+QUEUE_SECONDS = metrics.registry.histogram(
+    "skill_intent_queue_seconds",
+    "Time the intents waited for the intents of the same site before being "
+    "handled")
+
+
+# runs the intent callbacks from an asyncio event loop on its own thread, so
+# that the Hermes callback thread only hands the intents over
+# the intents of one site are handled one after the other, in the order they
+# came, and the intents of different sites at the same time, each on a worker
+# thread since the handlers do blocking I/O
+class AsyncRunner(object):
+
+    def __init__(self, workers=8):
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="intent")
+        self._loop = None
+        self._thread = None
+        # site id -> [lock, intents holding or waiting for it], only used
+        # on the loop thread
+        self._sites = {}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.call_soon(started.set)
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="intent-loop")
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # returns a callback for Hermes that runs
+    # callback(hermes, intent_message, arrived=<perf_counter() on arrival>)
+    # on the loop and returns at once
+    def wrap(self, callback):
+        def submit(hermes, intent_message):
+            future = asyncio.run_coroutine_threadsafe(
+                self._handle(callback, hermes, intent_message,
+                             time.perf_counter()), self._loop)
+            future.add_done_callback(self._report)
+        submit.__name__ = getattr(callback, "__name__", "intent")
+        return submit
+
+    async def _handle(self, callback, hermes, intent_message, queued):
+        site_id = intent_message.site_id
+        site = self._sites.get(site_id)
+        if site is None:
+            site = self._sites[site_id] = [asyncio.Lock(), 0]
+        site[1] += 1
+        try:
+            async with site[0]:
+                QUEUE_SECONDS.observe((), time.perf_counter() - queued)
+                return await self._loop.run_in_executor(
+                    self._executor, functools.partial(
+                        callback, hermes, intent_message, arrived=queued))
+        finally:
+            site[1] -= 1
+            if not site[1]:
+                del self._sites[site_id]
+
+    def _report(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            error = future.exception()
+            log.error("Intent handler failed: %s", error,
+                      exc_info=(type(error), error, error.__traceback__))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect
+import re
+
+UNITS = ["zero", "one", "two", "three", "four", "five", "six", "seven",
+         "eight", "nine", "ten", "eleven", "twelve", "thirteen", "fourteen",
+         "fifteen", "sixteen", "seventeen", "eighteen", "nineteen"]
+TENS = ["twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty",
+        "ninety"]
+SCALES = {"hundred": 100, "thousand": 1000, "million": 1000000}
+IRREGULAR_ORDINALS = {"one": "first", "two": "second", "three": "third",
+                      "five": "fifth", "eight": "eighth", "nine": "ninth",
+                      "twelve": "twelfth"}
+
+# words around the choice which do not change its meaning, e.g. "the
+# experiment number twelve", "the third one" or "the salt one please"
+FILLERS = frozenset(["the", "a", "an", "and", "number", "no", "experiment",
+                     "procedure", "please", "called", "named", "one"])
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+DIGITS_PATTERN = re.compile(r"^(\d+)(st|nd|rd|th)?$")
+
+
+def _ordinal(word):
+    if word in IRREGULAR_ORDINALS:
+        return IRREGULAR_ORDINALS[word]
+    if word.endswith("y"):
+        return word[:-1] + "ieth"
+    return word + "th"
+
+
+# spoken word -> (value, True for ordinals)
+NUMBER_WORDS = {}
+for _value, _word in enumerate(UNITS):
+    NUMBER_WORDS[_word] = (_value, False)
+    NUMBER_WORDS[_ordinal(_word)] = (_value, True)
+for _value, _word in enumerate(TENS, 2):
+    NUMBER_WORDS[_word] = (_value * 10, False)
+    NUMBER_WORDS[_ordinal(_word)] = (_value * 10, True)
+for _word, _value in SCALES.items():
+    NUMBER_WORDS[_ordinal(_word)] = (_value, True)
+
+
+def tokens(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+# returns the number said in words or digits, as cardinal ("one hundred and
+# twelve", "112") or ordinal ("hundred twelfth", "112th"), or None when the
+# text is not only a number
+# numbers said one after the other without a scale between them, e.g. "one
+# two", "nineteen ninety" or "1 2", are not one number: only a unit may
+# follow a tens word, as in "twenty one"
+def spoken_number(text):
+    if isinstance(text, (int, float)):
+        return int(text)
+
+    total = 0
+    current = 0
+    found = False
+    ordinal = False
+    # "units" (a unit, a teen or digits), "tens" or "scale", of the last
+    # number word
+    last = None
+    for token in tokens(text):
+        if ordinal:
+            # "the third one"
+            if token in FILLERS:
+                continue
+            return None
+
+        match = DIGITS_PATTERN.match(token)
+        if match:
+            if last not in (None, "scale"):
+                return None
+            current += int(match.group(1))
+            ordinal = match.group(2) is not None
+            last = "units"
+        elif token in SCALES:
+            current = max(current, 1) * SCALES[token]
+            if SCALES[token] > 100:
+                total += current
+                current = 0
+            last = "scale"
+        elif token in NUMBER_WORDS:
+            value, ordinal = NUMBER_WORDS[token]
+            if value in SCALES.values() and ordinal:
+                current = max(current, 1) * value
+                last = "scale"
+            elif value < 20:
+                if last == "units" or (last == "tens" and value >= 10):
+                    return None
+                current += value
+                last = "units"
+            else:
+                if last in ("units", "tens"):
+                    return None
+                current += value
+                last = "tens"
+        elif token in FILLERS:
+            continue
+        else:
+            return None
+        found = True
+
+    if not found:
+        return None
+    return total + current
+
+
+# maps what the user said to the order number of a procedure of the list
+# (numbers and ordinals of any size, or words of the title), through indexes
+# built once per list: the title words are an inverted index, kept sorted so
+# that the start of a word finds every word it begins
+class SelectionResolver(object):
+
+    def __init__(self, procedures):
+        self.procedures = procedures
+
+        # title word -> order numbers of the procedures with the word
+        self._postings = {}
+        # title -> order number
+        self._titles = {}
+        for order_number, procedure in enumerate(procedures, 1):
+            title = procedure.title
+            self._titles.setdefault(" ".join(tokens(title)), order_number)
+            for token in set(tokens(title)):
+                self._postings.setdefault(token, set()).add(order_number)
+        self._vocabulary = sorted(self._postings)
+
+    # returns the order numbers the choice may mean, the number said even if
+    # there is no such procedure, and an empty list when nothing matches
+    def resolve(self, choice):
+        if choice is None:
+            return []
+
+        number = spoken_number(choice)
+        if number is not None:
+            return [number]
+
+        exact = self._titles.get(" ".join(tokens(choice)))
+        if exact is not None:
+            return [exact]
+
+        words = [token for token in tokens(choice) if token not in FILLERS]
+        if not words:
+            return []
+
+        matches = None
+        for postings in sorted((self._lookup(word) for word in words), key=len):
+            matches = postings if matches is None else matches & postings
+            if not matches:
+                return []
+        return sorted(matches)
+
+    # order numbers of the titles with a word starting with the given one
+    def _lookup(self, word):
+        postings = self._postings.get(word)
+        if postings is not None:
+            return postings
+
+        found = set()
+        index = bisect.bisect_left(self._vocabulary, word)
+        while (index < len(self._vocabulary) and
+               self._vocabulary[index].startswith(word)):
+            found |= self._postings[self._vocabulary[index]]
+            index += 1
+        return found
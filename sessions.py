@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+# dialogue state of one site (one satellite or lab station)
+class Session(object):
+
+    def __init__(self, site_id):
+        self.site_id = site_id
+
+        # intents of the same site are handled one after the other
+        self.lock = threading.RLock()
+        self.last_seen = time.monotonic()
+
+        # save the current state
+        self.stage = 0
+        self.state = 0
+        self.reset()
+
+    # forgets the procedure data, e.g. when the experiment is finished
+    def reset(self):
+        # save the page of the procedures list that was read out, from 0
+        self.procedures_list = ""
+        self.procedures_page = 0
+
+        # save the selected procedure, start at 1
+        self.selected_procedure = 0
+        self.selected_procedure_title = ""
+        self.resources_list = ""
+
+        # save the steps data, the steps around the current one and their
+        # utterances are in a steps.StepWindow
+        self.steps = None
+        self.current_step = -1
+        self.total_steps = -1
+
+    # number of the current step, from 1, moving the step window along
+    @property
+    def current_step(self):
+        return self._current_step
+
+    @current_step.setter
+    def current_step(self, number):
+        self._current_step = number
+        if self.steps is not None and number >= 1:
+            self.steps.move(number)
+
+    # model.Step of the current step
+    @property
+    def step(self):
+        return self.steps.step(self.current_step)
+
+    # fields kept in the session journal, the steps themselves are loaded
+    # again from the snapshot on restore
+    CHECKPOINT_FIELDS = ("stage", "state", "procedures_list", "procedures_page",
+                         "selected_procedure", "selected_procedure_title",
+                         "resources_list", "current_step", "total_steps")
+
+    # returns the state of the session as a JSON-serialisable dict
+    def checkpoint(self):
+        return dict((field, getattr(self, field))
+                    for field in self.CHECKPOINT_FIELDS)
+
+    # puts the session back into the state of a checkpoint
+    def restore(self, checkpoint):
+        for field in self.CHECKPOINT_FIELDS:
+            if field in checkpoint:
+                setattr(self, field, checkpoint[field])
+
+    # pre-rendered utterance of the current step
+    def step_message(self, variant):
+        return self.steps.message(self.current_step, variant)
+
+
+# thread-safe store of the sessions by site id
+# sessions not used for idle_timeout seconds are dropped, and when more than
+# max_sessions sites are active the least recently used session is dropped
+class SessionStore(object):
+
+    def __init__(self, idle_timeout=1800, max_sessions=64, on_evict=None):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.on_evict = on_evict
+
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()
+
+    # returns the session of the site, creating it on its first intent
+    def get(self, site_id):
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            session = self._sessions.pop(site_id, None)
+            if session is None:
+                session = Session(site_id)
+            session.last_seen = now
+            self._sessions[site_id] = session
+
+            # the least recently used sessions come first
+            for other_id, other in list(self._sessions.items()):
+                if other is session:
+                    break
+                if (len(self._sessions) > self.max_sessions or
+                        now - other.last_seen > self.idle_timeout):
+                    del self._sessions[other_id]
+                    evicted.append(other)
+                else:
+                    break
+
+        for session_evicted in evicted:
+            log.info("Dropping the idle session of site %s",
+                     session_evicted.site_id)
+            if self.on_evict is not None:
+                self.on_evict(session_evicted)
+
+        return session
+
+    # returns the sessions currently kept, least recently used first
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
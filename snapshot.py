@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from backend import BackendUnavailable, check_answer
+from catalog import CACHE_LOOKUPS
+
+log = logging.getLogger(__name__)
+
+
+# local copy of the answers of the DB API (/procedures, /procedures/{id} and
+# /proceduresteps/{id}) in a SQLite file, so that the skill can answer when
+# the DB is down and right after a restart
+# every document is kept with the ETag / Last-Modified it was served with, so
+# that refreshing it only downloads what changed
+# the steps of a steps document are kept one per row, so that they can be
+# read a few at a time with get_steps()
+# the file is only opened on first use
+class ProcedureSnapshot(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        self._lock = threading.Lock()
+        self._db = None
+
+    @property
+    def _connection(self):
+        if self._db is None:
+            connection = sqlite3.connect(self.filename,
+                                         check_same_thread=False)
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS documents ("
+                    "path TEXT PRIMARY KEY, body TEXT NOT NULL, etag TEXT, "
+                    "last_modified TEXT, fetched_at REAL NOT NULL)")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS steps ("
+                    "path TEXT NOT NULL, number INTEGER NOT NULL, "
+                    "body TEXT NOT NULL, PRIMARY KEY (path, number))")
+            self._db = connection
+        return self._db
+
+    # returns the stored document as parsed JSON, or None
+    def get(self, path):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT body FROM documents WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        document = json.loads(row[0])
+        if isinstance(document, dict) and document.get("steps", []) is None:
+            document["steps"] = [step for number, step in
+                                 self.get_steps(path, 1, None)]
+        return document
+
+    # returns True if there is a stored copy of the document
+    def has(self, path):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM documents WHERE path = ?", (path,)).fetchone()
+        return row is not None
+
+    # returns [(number, step)] for the stored steps first..last (up to the
+    # end when last is None) of a steps document, numbered from 1
+    # with raw, the steps are returned as their JSON text
+    def get_steps(self, path, first, last, raw=False):
+        upper = last if last is not None else 2 ** 62
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT number, body FROM steps WHERE path = ? AND number >= ? "
+                "AND number <= ? ORDER BY number",
+                (path, first, upper)).fetchall()
+            if not rows:
+                stored = self._connection.execute(
+                    "SELECT body FROM documents WHERE path = ?",
+                    (path,)).fetchone()
+        if rows:
+            return [(number, body if raw else json.loads(body))
+                    for number, body in rows]
+
+        # stored before the steps had their own rows
+        steps = json.loads(stored[0]).get("steps") if stored else None
+        if not steps:
+            return []
+        steps = list(enumerate(steps, 1))[first - 1:last]
+        if raw:
+            return [(number, json.dumps(step, separators=(",", ":")))
+                    for number, step in steps]
+        return steps
+
+    # returns the request headers to revalidate the stored document
+    def validators(self, path):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag, last_modified FROM documents WHERE path = ?",
+                (path,)).fetchone()
+        headers = {}
+        if row is not None:
+            if row[0]:
+                headers["If-None-Match"] = row[0]
+            if row[1]:
+                headers["If-Modified-Since"] = row[1]
+        return headers
+
+    # stores the document with the validators of the response it came from
+    def put(self, path, document, etag=None, last_modified=None):
+        steps = None
+        if isinstance(document, dict) and isinstance(document.get("steps"),
+                                                     list):
+            steps = [(path, number, json.dumps(step, separators=(",", ":")))
+                     for number, step in enumerate(document["steps"], 1)]
+            document = dict(document, steps=None)
+        body = json.dumps(document, separators=(",", ":"))
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                (path, body, etag, last_modified, time.time()))
+            self._connection.execute("DELETE FROM steps WHERE path = ?",
+                                     (path,))
+            if steps:
+                self._connection.executemany(
+                    "INSERT INTO steps VALUES (?, ?, ?)", steps)
+
+    # drops the stored documents whose path is not in the list
+    def keep_only(self, paths):
+        paths = set(paths)
+        with self._lock:
+            stored = [row[0] for row in self._connection.execute(
+                "SELECT path FROM documents")]
+        removed = [(path,) for path in stored if path not in paths]
+        if removed:
+            with self._lock, self._connection:
+                self._connection.executemany(
+                    "DELETE FROM documents WHERE path = ?", removed)
+                self._connection.executemany(
+                    "DELETE FROM steps WHERE path = ?", removed)
+
+    # GETs the document from the DB API, revalidating the stored copy, and
+    # falls back to the stored copy when the DB API cannot be reached
+    # without load, only makes sure the stored copy is up to date, and returns
+    # None instead of reading it back
+    def fetch(self, client, path, load=True):
+        try:
+            response = client.get(path, headers=self.validators(path))
+        except BackendUnavailable as e:
+            if not self.has(path):
+                raise
+            CACHE_LOOKUPS.inc(("snapshot", "fallback"))
+            log.warning("Serving %s from the snapshot: %s", path, e)
+            return self.get(path) if load else None
+
+        if response.status_code == 304:
+            if self.has(path):
+                return self.get(path) if load else None
+            # the copy disappeared in the meantime, ask for the full answer
+            response = client.get(path)
+
+        check_answer(response, "GET", path)
+        document = response.json()
+        self.put(path, document, response.headers.get("ETag"),
+                 response.headers.get("Last-Modified"))
+        return document
+
+    # brings the whole snapshot up to date with the DB API, one conditional
+    # request per document
+    # a document that cannot be refreshed keeps its stored copy, and the
+    # documents of in_use() (e.g. the procedures the sessions are running)
+    # are kept even when they are not in the list anymore
+    def refresh(self, client, procedures_path="/procedures",
+                procedure_path="/procedures/", steps_path="/proceduresteps/",
+                in_use=None):
+        procedures = self.fetch(client, procedures_path)
+        paths = [procedures_path]
+        for procedure in procedures:
+            for path in (procedure_path + str(procedure["id"]),
+                         steps_path + str(procedure["id"])):
+                try:
+                    self.fetch(client, path, load=False)
+                except BackendUnavailable as e:
+                    log.warning("Cannot refresh %s in the snapshot: %s", path,
+                                e)
+                paths.append(path)
+        if in_use is not None:
+            paths.extend(in_use())
+        self.keep_only(paths)
+        return len(paths)
+
+    # refreshes the snapshot now and then every interval seconds, on a
+    # background thread
+    def refresh_in_background(self, client, interval, in_use=None):
+        def run():
+            while True:
+                try:
+                    count = self.refresh(client, in_use=in_use)
+                    log.info("Procedure snapshot refreshed, %d documents",
+                             count)
+                except Exception as e:
+                    log.warning("Procedure snapshot refresh failed: %s", e)
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="snapshot-refresh")
+        thread.daemon = True
+        thread.start()
+        return thread
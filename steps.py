@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+# loads the steps ahead of the current one for every window
+_executor = ThreadPoolExecutor(max_workers=2)
+
+
+# the steps of a procedure around the current step, with their utterances
+# only the steps at most radius steps away from the current one are kept: the
+# current step is loaded when it is needed, the radius steps after it (or
+# before it, when going back) in the background, and the others are dropped
+class StepWindow(object):
+
+    def __init__(self, load, render, radius=3):
+        # load(first, last) returns [(number, step)] for the steps first..last
+        self._load = load
+        # render(number, step) returns variant -> utterance of the step
+        self._render = render
+        self.radius = radius
+
+        self._lock = threading.Lock()
+        # step number -> (step, utterances)
+        self._steps = {}
+        self._current = None
+
+    # moves the window to the step number, e.g. when the user says next
+    def move(self, number):
+        with self._lock:
+            previous = self._current
+            self._current = number
+            for kept in list(self._steps):
+                if abs(kept - number) > self.radius:
+                    del self._steps[kept]
+
+        if previous is not None and number < previous:
+            ahead = (number - self.radius, number - 1)
+        else:
+            ahead = (number + 1, number + self.radius)
+
+        if previous is None:
+            # nothing loaded yet, read the first steps at once
+            self._fetch(min(number, ahead[0]), max(number, ahead[1]))
+        else:
+            self._entry(number)
+            _executor.submit(self._prefetch, ahead[0], ahead[1])
+
+    # returns the step, as given by load
+    def step(self, number):
+        return self._entry(number)[0]
+
+    # returns the utterance of the step for a variant of StepMessages
+    def message(self, number, variant):
+        return self._entry(number)[1][variant]
+
+    def _entry(self, number):
+        with self._lock:
+            entry = self._steps.get(number)
+        if entry is None:
+            self._fetch(number, number)
+            with self._lock:
+                entry = self._steps.get(number)
+        if entry is None:
+            raise IndexError("No step {}".format(number))
+        return entry
+
+    def _prefetch(self, first, last):
+        with self._lock:
+            missing = [number for number in range(max(first, 1), last + 1)
+                       if number not in self._steps]
+        if missing:
+            try:
+                self._fetch(missing[0], missing[-1])
+            except Exception as e:
+                log.warning("Loading steps %d to %d failed: %s", missing[0],
+                            missing[-1], e)
+
+    def _fetch(self, first, last):
+        loaded = [(number, (step, self._render(number, step)))
+                  for number, step in self._load(max(first, 1), last)]
+        with self._lock:
+            for number, entry in loaded:
+                # the window may have moved on while loading
+                if (self._current is None or
+                        abs(number - self._current) <= self.radius):
+                    self._steps.setdefault(number, entry)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backend
+from backend import BackendClient, BackendUnavailable, DeadlineExceeded
+
+
+# answers /ok with 200, /error with 500 and /slow with 200 after 0.5 seconds
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(0.5)
+        status = 500 if self.path == "/error" else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class HalfOpenBreakerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(("127.0.0.1", 0), StubHandler)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        cls.url = "http://127.0.0.1:{}".format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.client = BackendClient(self.url, failure_threshold=1,
+                                    reset_timeout=0.05, name="test")
+        self.addCleanup(backend.clear_deadline)
+
+    # opens the breaker and waits until it lets a trial request through
+    def open_breaker(self):
+        with self.assertRaises(BackendUnavailable):
+            self.client.get("/error")
+        self.assertTrue(self.client.breaker.is_open)
+        with self.assertRaises(BackendUnavailable):
+            self.client.get("/ok")
+        time.sleep(0.1)
+
+    def test_successful_trial_closes_the_breaker(self):
+        self.open_breaker()
+        self.assertEqual(self.client.get("/ok").status_code, 200)
+        self.assertFalse(self.client.breaker.is_open)
+
+    def test_failed_trial_opens_the_breaker_again(self):
+        self.open_breaker()
+        with self.assertRaises(BackendUnavailable):
+            self.client.get("/error")
+        with self.assertRaises(BackendUnavailable):
+            self.client.get("/ok")
+        time.sleep(0.1)
+        self.assertEqual(self.client.get("/ok").status_code, 200)
+
+    def test_no_time_left_does_not_take_the_trial(self):
+        self.open_breaker()
+        backend.set_deadline(0)
+        with self.assertRaises(DeadlineExceeded):
+            self.client.get("/ok")
+        backend.clear_deadline()
+        self.assertEqual(self.client.get("/ok").status_code, 200)
+
+    def test_trial_cut_by_the_deadline_is_given_back(self):
+        self.open_breaker()
+        backend.set_deadline(0.1)
+        with self.assertRaises(DeadlineExceeded):
+            self.client.get("/slow")
+        backend.clear_deadline()
+        self.assertEqual(self.client.get("/ok").status_code, 200)
+        self.assertFalse(self.client.breaker.is_open)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import iter_json_array
+
+DOCUMENTS = [
+    '[]',
+    ' [ ] ',
+    '[12500.0]',
+    '[1e5, -2, 0.25, 3E-2]',
+    '[true, false, null]',
+    '[12, "twelve", {"id": 12, "title": "Salt, water ]"}, [1, [2]], 7]',
+    '\n[\n  {"id": 1, "title": "Titration"},\n  {"id": 2, "title": "pH"}\n]\n',
+    '["\\"quoted\\" \\u00e9", 3]',
+]
+
+
+# every way to cut the text in two chunks
+def splits(text):
+    for index in range(len(text) + 1):
+        yield [text[:index], text[index:]]
+
+
+class IterJsonArrayTest(unittest.TestCase):
+
+    def test_whole_document(self):
+        for document in DOCUMENTS:
+            self.assertEqual(list(iter_json_array([document])),
+                             json.loads(document), document)
+
+    def test_every_split_point(self):
+        for document in DOCUMENTS:
+            for chunks in splits(document):
+                self.assertEqual(list(iter_json_array(chunks)),
+                                 json.loads(document), chunks)
+
+    def test_one_character_chunks(self):
+        for document in DOCUMENTS:
+            self.assertEqual(list(iter_json_array(list(document))),
+                             json.loads(document), document)
+
+    def test_number_split_across_chunks(self):
+        self.assertEqual(list(iter_json_array(["[12", "500.0]"])), [12500.0])
+        self.assertEqual(list(iter_json_array(["[1", "e5]"])), [1e5])
+
+    def test_elements_before_the_end(self):
+        elements = iter_json_array(iter(['[{"id": 1}, ', '{"id": 2}']))
+        self.assertEqual(next(elements), {"id": 1})
+        self.assertEqual(next(elements), {"id": 2})
+        self.assertRaises(ValueError, next, elements)
+
+    def test_invalid_documents(self):
+        for document in ['{"id": 1}', '[1, 2', '[1, 2] x', '[1, 2]]', '[1 2]',
+                         '[1,, 2]', '[1, ]', '[,1]', '[1x]', '[tru]', '']:
+            for chunks in splits(document):
+                with self.assertRaises(ValueError, msg=chunks):
+                    list(iter_json_array(chunks))
+
+
+if __name__ == "__main__":
+    unittest.main()
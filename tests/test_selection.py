@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import Procedure
+from selection import SelectionResolver, spoken_number
+
+TITLES = ["Salt water titration", "Soil pH", "Salt crystals",
+          "Plant growth under LED light", "Water filtration"]
+
+
+class SpokenNumberTest(unittest.TestCase):
+
+    def test_cardinals(self):
+        for text, number in [("one", 1), ("twelve", 12), ("twenty one", 21),
+                             ("ninety", 90), ("one hundred and twelve", 112),
+                             ("hundred five", 105), ("two thousand", 2000),
+                             ("two thousand and twenty", 2020), ("112", 112),
+                             ("the experiment number twelve", 12), (7, 7)]:
+            self.assertEqual(spoken_number(text), number, text)
+
+    def test_ordinals(self):
+        for text, number in [("first", 1), ("the third one", 3),
+                             ("twelfth", 12), ("twenty first", 21),
+                             ("fortieth", 40), ("hundredth", 100),
+                             ("hundred twelfth", 112), ("3rd", 3),
+                             ("112th", 112)]:
+            self.assertEqual(spoken_number(text), number, text)
+
+    def test_numbers_one_after_the_other(self):
+        for text in ["one two", "nineteen ninety", "1 2", "twenty thirty",
+                     "twenty twelve", "three twenty", "one and two",
+                     "twelve 3"]:
+            self.assertIsNone(spoken_number(text), text)
+
+    def test_not_a_number(self):
+        for text in ["", "the", "salt", "third salt", "one salt"]:
+            self.assertIsNone(spoken_number(text), text)
+
+
+class SelectionResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.resolver = SelectionResolver(
+            [Procedure(index, title, "{}")
+             for index, title in enumerate(TITLES, 1)])
+
+    def test_numbers(self):
+        self.assertEqual(self.resolver.resolve("two"), [2])
+        self.assertEqual(self.resolver.resolve("the fourth one"), [4])
+        self.assertEqual(self.resolver.resolve(3), [3])
+        # a number said is kept even without such a procedure
+        self.assertEqual(self.resolver.resolve("twelve"), [12])
+
+    def test_whole_title(self):
+        self.assertEqual(self.resolver.resolve("soil ph"), [2])
+        self.assertEqual(self.resolver.resolve("the Salt Crystals please"),
+                         [3])
+
+    def test_start_of_title_words(self):
+        self.assertEqual(self.resolver.resolve("filtra"), [5])
+        self.assertEqual(self.resolver.resolve("salt tit"), [1])
+        self.assertEqual(self.resolver.resolve("plant gro"), [4])
+
+    def test_ambiguous_titles(self):
+        self.assertEqual(self.resolver.resolve("salt"), [1, 3])
+        self.assertEqual(self.resolver.resolve("water"), [1, 5])
+        self.assertEqual(self.resolver.resolve("s"), [1, 2, 3])
+
+    def test_nothing_matches(self):
+        self.assertEqual(self.resolver.resolve("volcano"), [])
+        self.assertEqual(self.resolver.resolve("salt soil"), [])
+        self.assertEqual(self.resolver.resolve("the experiment"), [])
+        self.assertEqual(self.resolver.resolve(None), [])
+
+
+if __name__ == "__main__":
+    unittest.main()